@@ -2,7 +2,7 @@
 from fastapi import FastAPI, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 import io, os, time
 
 import torch
@@ -25,6 +25,9 @@ YOLO_MODEL_PATH = os.getenv(
 )
 YOLO_CONF_DEFECT = float(os.getenv("YOLO_CONF_DEFECT", "0.5"))  # YOLO 결함 판단 conf 임계값 (클래스 1)
 
+# TTA 뷰(전처리 2종 × 좌우반전)를 한 번의 forward로 묶을지 여부 (0이면 기존 뷰별 forward)
+TTA_BATCHED = os.getenv("TTA_BATCHED", "1") == "1"
+
 # ===================== Multitask Model ======================
 class InductorMT(nn.Module):
     """멀티태스크: type(101/701) + defect(불량)"""
@@ -126,12 +129,51 @@ def build_tf_square(img_size: int):
 
 TF_LIST = [build_tf_center(IMG_SIZE), build_tf_square(IMG_SIZE)]
 
+def build_tta_batch(img: Image.Image) -> torch.Tensor:
+    """전처리 2종 × 좌우반전 뷰를 (V, 3, H, W) 텐서 하나로 쌓음"""
+    x = torch.stack([tf(img) for tf in TF_LIST], 0)
+    return torch.cat([x, torch.flip(x, dims=[3])], 0)
+
+def decide(type_logits: torch.Tensor, def_logit: torch.Tensor) -> Dict:
+    """
+    TTA 평균 logit(배치 1) → 최종 라벨 + 확률.
+    """
+    p_def = torch.sigmoid(def_logit.float())[0].item()
+    p_type = F.softmax(type_logits.float(), dim=1)[0]
+
+    # 최종 판정: defect / hold / 101/701
+    if p_def >= THRESH_HIGH:
+        final = "defect"
+    elif p_def >= THRESH_LOW:
+        final = "hold"
+    else:
+        idx = int(torch.argmax(p_type).item())
+        final = "101_top" if idx == 0 else "701_top"
+
+    probs = {
+        "defect": float(p_def),
+        "101_top": float(p_type[0].item()),
+        "701_top": float(p_type[1].item()),
+    }
+    return {"final": final, "probs": probs}
+
 @torch.inference_mode()
-def infer_pil(img: Image.Image) -> Dict:
+def infer_pil(img: Image.Image, batched: Optional[bool] = None) -> Dict:
     """
     멀티태스크 모델로 101/701 + defect 확률 계산 + 최종 라벨.
+    batched=None이면 TTA_BATCHED 설정을 따름 (False: 기존 뷰별 forward, 비교용).
     """
     img = img.convert("RGB")
+    if batched is None:
+        batched = TTA_BATCHED
+
+    if batched:
+        # 모든 TTA 뷰를 한 번에 forward 후 logit 평균
+        x = build_tta_batch(img).to(DEVICE, non_blocking=True)
+        with torch.cuda.amp.autocast(enabled=(DEVICE.type == "cuda")):
+            type_logits, def_logit = model(x)
+        return decide(type_logits.mean(0, keepdim=True), def_logit.mean(0, keepdim=True))
+
     type_logits_sum = None
     def_logit_sum = 0.0
 
@@ -146,27 +188,7 @@ def infer_pil(img: Image.Image) -> Dict:
             def_logit_sum += def_logit
 
     n = len(TF_LIST) * 2
-    type_logits = type_logits_sum / n
-    def_logit = def_logit_sum / n
-
-    p_def = torch.sigmoid(def_logit)[0].item()
-    p_type = F.softmax(type_logits, dim=1)[0]
-
-    # 최종 판정: defect / hold / 101/701
-    if p_def >= THRESH_HIGH:
-        final = "defect"
-    elif p_def >= THRESH_LOW:
-        final = "hold"
-    else:
-        idx = int(torch.argmax(p_type).item())
-        final = "101_top" if idx == 0 else "701_top"
-
-    probs = {
-        "defect": float(p_def),
-        "101_top": float(p_type[0].item()),
-        "701_top": float(p_type[1].item()),
-    }
-    return {"final": final, "probs": probs}
+    return decide(type_logits_sum / n, def_logit_sum / n)
 
 # ===================== FastAPI =====================
 app = FastAPI(
@@ -189,7 +211,7 @@ def _startup():
     # 멀티태스크 모델 워밍업(선택)
     try:
         with torch.inference_mode():
-            x = torch.zeros(1, 3, IMG_SIZE, IMG_SIZE, device=DEVICE)
+            x = torch.zeros(len(TF_LIST) * 2 if TTA_BATCHED else 1, 3, IMG_SIZE, IMG_SIZE, device=DEVICE)
             _ = model(x)
     except Exception:
         pass
@@ -207,7 +229,7 @@ def health():
         "ckpt_path": CKPT_PATH,
         "yolo_model_path": YOLO_MODEL_PATH,
         "yolo_conf_defect": YOLO_CONF_DEFECT,
-        "tta": {"transforms": ["center", "squarepad"], "flip": True},
+        "tta": {"transforms": ["center", "squarepad"], "flip": True, "batched": TTA_BATCHED},
     }
 
 class PredictOut(BaseModel):
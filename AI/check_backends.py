@@ -0,0 +1,87 @@
+# check_backends.py
+# eager PyTorch 대비 TorchScript / ONNX 백엔드 출력 비교 (샘플 이미지 폴더 기준)
+#   python check_backends.py frames_all/101_top --backends torchscript onnx --limit 32
+import argparse
+from pathlib import Path
+
+import torch
+
+import test as server  # AI 서버 모듈 (모델/전처리 그대로 재사용)
+
+
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def list_images(root: Path, limit: int):
+    paths = sorted(p for p in root.rglob("*") if p.suffix.lower() in IMG_EXTS)
+    return paths[:limit] if limit > 0 else paths
+
+
+@torch.inference_mode()
+def compare_mt(eager, backend, imgs):
+    """TTA 배치 logit 최대 오차 + 최종 라벨 일치 수"""
+    max_type, max_def, agree = 0.0, 0.0, 0
+    for img in imgs:
+        x = server.build_tta_batch(img).to(server.DEVICE)
+        t0, d0 = eager(x)
+        t1, d1 = backend(x)
+        max_type = max(max_type, (t0.float() - t1.float()).abs().max().item())
+        max_def = max(max_def, (d0.float() - d1.float()).abs().max().item())
+        r0 = server.decide(t0.mean(0, keepdim=True), d0.mean(0, keepdim=True))
+        r1 = server.decide(t1.mean(0, keepdim=True), d1.mean(0, keepdim=True))
+        agree += int(r0["final"] == r1["final"])
+    return max_type, max_def, agree
+
+
+def compare_yolo(eager, backend, imgs):
+    """Scratch_Defect 개수 일치 수 + max_conf 최대 오차"""
+    max_conf, agree = 0.0, 0
+    for img in imgs:
+        kw = dict(conf=server.YOLO_CONF_DEFECT, imgsz=server.YOLO_IMGSZ, verbose=False)
+        y0 = server._parse_yolo_result(eager.predict(img, **kw)[0])
+        y1 = server._parse_yolo_result(backend.predict(img, **kw)[0])
+        agree += int(y0["num_defects"] == y1["num_defects"])
+        max_conf = max(max_conf, abs(y0["max_conf"] - y1["max_conf"]))
+    return max_conf, agree
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("image_dir", type=Path)
+    ap.add_argument("--backends", nargs="+", default=["torchscript", "onnx"])
+    ap.add_argument("--limit", type=int, default=32)
+    ap.add_argument("--atol", type=float, default=1e-3)
+    args = ap.parse_args()
+
+    server.load_models()
+    paths = list_images(args.image_dir, args.limit)
+    if not paths:
+        print(f"[WARN] {args.image_dir} 에 이미지 없음")
+        return 1
+    imgs = [server.decode_image(p.read_bytes()) for p in paths]
+    n = len(imgs)
+
+    eager_mt = server.EagerMT(server.model)
+    eager_yolo = server.load_yolo("torch", server.YOLO_MODEL_PATH)
+
+    failed = False
+    print(f"samples={n}, atol={args.atol}")
+    for name in args.backends:
+        mt = server.build_mt_backend(name, server.model, server.CKPT_PATH)
+        yolo = server.load_yolo(name, server.YOLO_MODEL_PATH)
+
+        max_type, max_def, mt_agree = compare_mt(eager_mt, mt, imgs)
+        max_conf, yolo_agree = compare_yolo(eager_yolo, yolo, imgs)
+        ok = max(max_type, max_def) <= args.atol and mt_agree == n and yolo_agree == n
+        failed |= not ok
+
+        print(f"\n=== {name} ({'OK' if ok else 'MISMATCH'}) ===")
+        print(f"  multitask: max|d type_logit|={max_type:.2e}  max|d def_logit|={max_def:.2e}  "
+              f"final 일치 {mt_agree}/{n}")
+        print(f"  yolo     : max|d max_conf|={max_conf:.2e}  num_defects 일치 {yolo_agree}/{n}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,24 @@
 # eval_folders.py
+# 폴더별 정답으로 혼동행렬 평가
+#   - DataLoader 워커로 디코딩/TTA 전처리 병렬화, N장씩 배치 forward
+#   - 이미지별 TTA 평균 logit(type 2 + defect 1)을 memmap(.npy)으로 캐시 → 임계값만 바꿀 땐 forward 없이 재계산
+#   - --sweep: THRESH_HIGH 격자(THRESH_LOW = HIGH - gap)에 대해 defect precision/recall, hold 비율 곡선을 NumPy로 계산
+#
+#   python eval_folders.py                               # 캐시 없으면 forward, 있으면 바로 혼동행렬
+#   python eval_folders.py --thresh-high 0.6 --thresh-low 0.5
+#   python eval_folders.py --sweep --curves curves.csv
+#   python eval_folders.py --quant dynamic               # fp32 vs INT8 비교
+import argparse
+import csv
+import json
 import os
 from pathlib import Path
 
+import numpy as np
 import torch
-from PIL import Image
+from torch.utils.data import DataLoader, Dataset
 
-from app.settings import settings
-from app.inference.pipeline import InferencePipeline
+import test as server  # AI 서버 모듈 (FastAPI에서 쓰는 모델/전처리 그대로 재사용)
 
 
 # 폴더 구조
@@ -23,43 +35,242 @@ CLASS_DIRS = {
     "defect": "defect",
 }
 
+LABELS = ["101_top", "701_top", "defect", "hold"]
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
 
-def main():
-    # 모델 로드 (FastAPI에서 쓰는 거 그대로 재사용)
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    pipe = InferencePipeline(settings.ckpt_path, device)
-
-    labels = ["101_top", "701_top", "defect", "hold"]
-    conf = {gt: {pred: 0 for pred in labels} for gt in CLASS_DIRS}
 
+# ===================== 데이터 =====================
+def list_items(root: Path):
+    """[(경로, 정답 라벨, 캐시 키)]. 캐시 키는 상대경로 + 크기 + 수정시각 (파일이 바뀌면 다시 계산)"""
+    items = []
     for folder_name, gt_label in CLASS_DIRS.items():
-        folder = ROOT_DIR / folder_name
+        folder = root / folder_name
         if not folder.exists():
             print(f"[WARN] {folder} 없음, 스킵")
             continue
-
-        for fname in os.listdir(folder):
-            if not fname.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")):
+        for p in sorted(folder.iterdir()):
+            if p.suffix.lower() not in IMG_EXTS:
                 continue
+            st = p.stat()
+            items.append((p, gt_label, f"{p.relative_to(root)}:{st.st_size}:{st.st_mtime_ns}"))
+    return items
+
+
+class TTADataset(Dataset):
+    """서버와 같은 디코딩(decode_image) + TTA 뷰 (V, 3, H, W)"""
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        return server.build_tta_batch(server.decode_image(self.paths[i].read_bytes()))
+
+
+def collate(views):
+    return torch.cat(views, 0), len(views)
+
+
+@torch.inference_mode()
+def compute_logits(backend, paths, batch: int, workers: int) -> np.ndarray:
+    """→ (N, 3) [type_101, type_701, defect] TTA 평균 logit"""
+    out = np.zeros((len(paths), 3), dtype=np.float32)
+    loader = DataLoader(TTADataset(paths), batch_size=batch, num_workers=workers, collate_fn=collate)
+    row = 0
+    for x, n in loader:
+        type_logits, def_logit = backend(server.mt_input(x.to(server.DEVICE, non_blocking=True)))
+        views = type_logits.shape[0] // n
+        out[row:row + n, :2] = type_logits.float().view(n, views, -1).mean(1).cpu().numpy()
+        out[row:row + n, 2] = def_logit.float().view(n, views).mean(1).cpu().numpy()
+        row += n
+        print(f"\r  forward {row}/{len(paths)}", end="", flush=True)
+    print()
+    return out
+
+
+# ===================== logit 캐시 =====================
+def _stamp(path: str) -> str:
+    return f"{path}@{os.path.getmtime(path) if os.path.exists(path) else 0}"
+
+
+def model_tag(backend_name: str, backend) -> str:
+    """logit에 영향을 주는 설정만 (임계값은 제외). INT8은 양자화 엔진 + static 산출물(quantize_mt.py 재보정 시 바뀜)까지"""
+    tag = f"{_stamp(server.CKPT_PATH)}|{backend_name}|{server.IMG_SIZE}|{len(server.TF_LIST) * 2}views"
+    if isinstance(backend, server.QuantMT):
+        tag += f"|{server.QUANT_ENGINE}"
+        if backend.path:
+            tag += f"|{_stamp(backend.path)}"
+    return tag
+
+
+def load_or_compute(cache_dir: Path, name: str, backend, items, batch: int, workers: int) -> np.ndarray:
+    """캐시에 있는 이미지는 memmap에서 읽고, 새로/바뀐 이미지만 forward 후 캐시를 다시 씀"""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    meta_path = cache_dir / f"{name}.json"
+    arr_path = cache_dir / f"{name}.npy"
+    tag = model_tag(name, backend)
+
+    keys = [k for _, _, k in items]
+    logits = np.zeros((len(items), 3), dtype=np.float32)
+    hit = np.zeros(len(items), dtype=bool)
+    if meta_path.exists() and arr_path.exists():
+        meta = json.loads(meta_path.read_text())
+        if meta.get("model") == tag:
+            old = np.load(arr_path, mmap_mode="r")
+            rows = {k: i for i, k in enumerate(meta["keys"])}
+            for i, k in enumerate(keys):
+                if k in rows:
+                    logits[i] = old[rows[k]]
+                    hit[i] = True
+            del old
+
+    missing = np.flatnonzero(~hit)
+    print(f"[{name}] cached {int(hit.sum())}/{len(items)}, forward {len(missing)}")
+    if not len(missing):
+        return logits
+
+    logits[missing] = compute_logits(backend, [items[i][0] for i in missing], batch, workers)
 
-            img_path = folder / fname
-            img = Image.open(img_path)
+    tmp = cache_dir / f"{name}.tmp.npy"
+    mm = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=logits.shape)
+    mm[:] = logits
+    mm.flush()
+    del mm
+    os.replace(tmp, arr_path)
+    meta_path.write_text(json.dumps({"model": tag, "keys": keys}))
+    return logits
 
-            out = pipe.infer_pil(img)  # {"final": "...", "probs": {...}}
-            pred = out["final"]
 
-            # 혼동행렬 집계
-            if pred not in conf[gt_label]:
-                conf[gt_label][pred] = 0
-            conf[gt_label][pred] += 1
+# ===================== 판정 (벡터화) =====================
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
 
-            # 개별 결과 보고 싶으면 유지, 많으면 주석 처리
-            print(f"[{gt_label}] {fname} -> {pred}  probs={out['probs']}")
 
-    print("\n=== Confusion matrix (count) ===")
+def decide_np(logits: np.ndarray, thresh_high: float, thresh_low: float) -> np.ndarray:
+    """server.decide와 같은 규칙을 N장에 한 번에 → 라벨 인덱스 (LABELS 기준)"""
+    p_def = sigmoid(logits[:, 2])
+    pred = np.where(logits[:, 1] > logits[:, 0], 1, 0)   # softmax argmax = logit argmax
+    pred = np.where(p_def >= thresh_low, 3, pred)
+    return np.where(p_def >= thresh_high, 2, pred)
+
+
+def confusion(gt: np.ndarray, pred: np.ndarray) -> dict:
+    gts = list(CLASS_DIRS.values())
+    m = np.zeros((len(gts), len(LABELS)), dtype=np.int64)
+    np.add.at(m, (gt, pred), 1)
+    return {g: {label: int(m[i, j]) for j, label in enumerate(LABELS)} for i, g in enumerate(gts)}
+
+
+def sweep(logits: np.ndarray, gt: np.ndarray, gap: float, steps: int) -> dict:
+    """THRESH_HIGH 격자 × 전체 이미지를 (T, N) 불리언으로 한 번에 계산 → 곡선별 배열"""
+    p_def = sigmoid(logits[:, 2])[None, :]
+    high = np.linspace(0.0, 1.0, steps)[:, None]
+    low = np.clip(high - gap, 0.0, 1.0)
+    is_def = (gt == LABELS.index("defect"))[None, :]
+
+    pred_def = p_def >= high
+    hold = (p_def >= low) & ~pred_def
+    tp = (pred_def & is_def).sum(1)
+    n_pred = pred_def.sum(1)
+    n_def = max(1, int(is_def.sum()))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = np.where(n_pred > 0, tp / n_pred, np.nan)
+    return {
+        "thresh_high": high[:, 0],
+        "thresh_low": low[:, 0],
+        "precision": precision,
+        "recall": tp / n_def,
+        "hold_rate": hold.mean(1),
+        "defect_hold_rate": (hold & is_def).sum(1) / n_def,
+    }
+
+
+def print_conf(title, conf):
+    print(f"\n=== {title} ===")
     for gt_label, row in conf.items():
         print(gt_label, row)
 
 
+def print_curves(curves: dict, every: int):
+    cols = list(curves)
+    print("".join(f"{c:>18}" for c in cols))
+    for i in range(0, len(curves["thresh_high"]), every):
+        print("".join(f"{curves[c][i]:>18.4f}" for c in cols))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--root", type=Path, default=ROOT_DIR)
+    ap.add_argument("--quant", choices=["dynamic", "static"], default=None,
+                    help="fp32 모델과 INT8 모델 혼동행렬을 나란히 비교")
+    ap.add_argument("--batch", type=int, default=8, help="forward 1회당 이미지 수")
+    ap.add_argument("--workers", type=int, default=4, help="DataLoader 디코딩/전처리 프로세스 수")
+    ap.add_argument("--cache", type=Path, default=Path("eval_cache"), help="logit 캐시 폴더")
+    ap.add_argument("--thresh-high", type=float, default=None, help="기본: 서버 THRESH_HIGH")
+    ap.add_argument("--thresh-low", type=float, default=None, help="기본: 서버 THRESH_LOW")
+    ap.add_argument("--sweep", action="store_true", help="THRESH_HIGH 격자 precision/recall/hold 곡선")
+    ap.add_argument("--sweep-steps", type=int, default=101)
+    ap.add_argument("--hold-gap", type=float, default=0.02, help="스윕 시 THRESH_LOW = THRESH_HIGH - gap")
+    ap.add_argument("--curves", type=Path, default=None, help="곡선 CSV 저장 경로")
+    ap.add_argument("--verbose", action="store_true", help="파일별 결과 출력")
+    args = ap.parse_args()
+    server.load_models()
+
+    items = list_items(args.root)
+    if not items:
+        print(f"[WARN] {args.root} 에 평가할 이미지 없음")
+        return 1
+    gt_names = list(CLASS_DIRS.values())
+    gt = np.array([gt_names.index(label) for _, label, _ in items])
+    th_high = server.THRESH_HIGH if args.thresh_high is None else args.thresh_high
+    th_low = server.THRESH_LOW if args.thresh_low is None else args.thresh_low
+
+    # 비교 대상 백엔드: fp32(eager) [+ INT8]
+    backends = {"fp32": server.EagerMT(server.model)}
+    if args.quant:
+        backends[f"int8-{args.quant}"] = server.QuantMT(args.quant, server.model, server.CKPT_PATH)
+
+    logits = {name: load_or_compute(args.cache, name, backend, items, args.batch, args.workers)
+              for name, backend in backends.items()}
+    preds = {name: decide_np(lg, th_high, th_low) for name, lg in logits.items()}
+    confs = {name: confusion(gt, p) for name, p in preds.items()}
+
+    if args.verbose:
+        # 백엔드마다 라벨과 p_def를 나란히 (--quant 비교 시 어느 백엔드 값인지 구분)
+        for i, (path, label, _) in enumerate(items):
+            per = {name: f"{LABELS[preds[name][i]]} p_def={sigmoid(lg[i, 2]):.4f}" for name, lg in logits.items()}
+            print(f"[{label}] {path.name} -> {per}")
+
+    for name, conf in confs.items():
+        print_conf(f"Confusion matrix ({name}, high={th_high:.3f}, low={th_low:.3f}, count)", conf)
+
+    # INT8 - fp32 셀별 차이
+    if args.quant:
+        base, quant = confs["fp32"], confs[f"int8-{args.quant}"]
+        delta = {g: {pred: quant[g][pred] - base[g][pred] for pred in LABELS} for g in CLASS_DIRS}
+        print_conf(f"Delta (int8-{args.quant} - fp32)", delta)
+        for g in CLASS_DIRS:
+            total = sum(base[g].values())
+            if total:
+                acc_b = base[g][g] / total
+                acc_q = quant[g][g] / total
+                print(f"{g}: recall fp32={acc_b:.4f} int8={acc_q:.4f} delta={acc_q - acc_b:+.4f}")
+
+    if args.sweep:
+        for name, lg in logits.items():
+            curves = sweep(lg, gt, args.hold_gap, args.sweep_steps)
+            print(f"\n=== Threshold sweep ({name}, low = high - {args.hold_gap}) ===")
+            print_curves(curves, max(1, args.sweep_steps // 20))
+            if args.curves:
+                path = args.curves if len(logits) == 1 else args.curves.with_name(f"{args.curves.stem}_{name}.csv")
+                with open(path, "w", newline="") as f:
+                    w = csv.writer(f)
+                    w.writerow(list(curves))
+                    w.writerows(zip(*curves.values()))
+                print(f"[OK] curves saved: {path}")
+    return 0
+
+
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
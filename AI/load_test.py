@@ -0,0 +1,273 @@
+# load_test.py
+# client_test.py(이미지 1장 POST)를 확장한 부하 발생기
+#   - 프레임 폴더를 /predict 또는 /predict_batch로 반복 재생
+#   - open-loop(고정 도착률 --rate) / closed-loop(고정 동시성 --concurrency)
+#   - 처리량, 오류율, 지연 분위수 표 출력
+#   - --inproc: 랜덤 가중치 소형 모델로 FastAPI 앱을 프로세스 안에서 띄워 체크포인트 없이 측정
+#
+#   python load_test.py --url http://localhost:8000 --frames frames_all --concurrency 4 --duration 30
+#   python load_test.py --inproc --rate 20 --duration 20
+#   python load_test.py --inproc --endpoint /predict_batch --batch-size 8 --concurrency 2
+import argparse
+import asyncio
+import io
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+# ===================== 입력 프레임 =====================
+def load_frames(folder, limit: int):
+    paths = sorted(p for p in Path(folder).rglob("*") if p.suffix.lower() in IMG_EXTS)
+    if limit > 0:
+        paths = paths[:limit]
+    return [(p.name, p.read_bytes()) for p in paths]
+
+
+def synthetic_frames(n: int, size=(1920, 1080)):
+    """프레임 폴더가 없을 때 쓰는 랜덤 JPEG (카메라 업로더와 같은 해상도)"""
+    from PIL import Image
+
+    frames = []
+    for i in range(n):
+        img = Image.effect_noise(size, random.uniform(20, 80)).convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=90)
+        frames.append((f"synthetic_{i:03d}.jpg", buf.getvalue()))
+    return frames
+
+
+# ===================== 인프로세스 서버 =====================
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _write_standin_ckpt(path: str, backbone: str, img_size: int):
+    """test.py InductorMT와 같은 키 구조의 랜덤 가중치 체크포인트"""
+    import timm
+    import torch
+    from torch import nn
+
+    class StandIn(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.backbone = timm.create_model(backbone, pretrained=False, num_classes=0, global_pool="avg")
+            f = self.backbone.num_features
+            self.head_type = nn.Linear(f, 2)
+            self.head_def = nn.Linear(f, 1)
+
+    torch.save({
+        "backbone": backbone,
+        "img": img_size,
+        "threshold_defect": 0.5,
+        "state_dict": StandIn().state_dict(),
+    }, path)
+
+
+def start_inproc_server(backbone: str, img_size: int, yolo_cfg: str) -> str:
+    """랜덤 가중치 모델로 test.py 앱을 백그라운드 스레드의 uvicorn에서 실행 → base URL"""
+    import uvicorn
+
+    tmp = tempfile.mkdtemp(prefix="ai_loadtest_")
+    ckpt_path = os.path.join(tmp, "standin_mt.pt")
+    _write_standin_ckpt(ckpt_path, backbone, img_size)
+
+    os.environ["CKPT_PATH"] = ckpt_path
+    os.environ["YOLO_MODEL_PATH"] = yolo_cfg      # *.yaml이면 ultralytics가 랜덤 가중치로 생성
+    os.environ.setdefault("YOLO_IMGSZ", "320")
+    os.environ["SPRING_NOTIFY_URL"] = ""
+    os.environ["MQTT_BROKER_URL"] = ""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import test as server  # 환경변수 설정 후 import 해야 stand-in 모델을 로드
+
+    port = _free_port()
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning")
+    uv = uvicorn.Server(config)
+    threading.Thread(target=uv.run, daemon=True).start()
+
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            # /ready는 모델 로드 + 워밍업이 끝나야 200
+            if httpx.get(f"{base}/ready", timeout=1.0).status_code == 200:
+                print(f"[INFO] in-process server ready at {base} (backbone={backbone}, img={img_size})")
+                return base
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("in-process server did not become ready")
+
+
+# ===================== 부하 발생 =====================
+class Stats:
+    def __init__(self):
+        self.latencies = []        # 요청 단위 클라이언트 측 지연 (ms)
+        self.server_latencies = [] # 응답 latency_ms (이미지 단위)
+        self.ok = 0
+        self.errors = 0
+        self.images = 0
+        self.error_kinds = {}
+
+    def error(self, kind: str):
+        self.errors += 1
+        self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+
+
+def _files_for(frames, i: int, endpoint: str, batch_size: int):
+    if endpoint == "/predict":
+        name, data = frames[i % len(frames)]
+        return [("file", (name, data, "image/jpeg"))], 1
+    picked = [frames[(i * batch_size + k) % len(frames)] for k in range(batch_size)]
+    return [("files", (name, data, "image/jpeg")) for name, data in picked], batch_size
+
+
+async def _send(client, url, frames, i, args, stats: Stats, t_intended: float):
+    files, n_images = _files_for(frames, i, args.endpoint, args.batch_size)
+    try:
+        r = await client.post(url, files=files)
+    except httpx.HTTPError as e:
+        stats.error(type(e).__name__)
+        return
+    # open-loop는 예정 전송 시각 기준으로 재서 대기열 지연도 포함 (coordinated omission 방지)
+    stats.latencies.append((time.perf_counter() - t_intended) * 1000)
+    if r.status_code != 200:
+        stats.error(f"HTTP {r.status_code}")
+        return
+    stats.ok += 1
+    stats.images += n_images
+    body = r.json()
+    for item in (body if isinstance(body, list) else [body]):
+        if "latency_ms" in item:
+            stats.server_latencies.append(item["latency_ms"])
+
+
+async def run_closed_loop(client, url, frames, args, stats: Stats):
+    counter = iter(range(10 ** 12))
+    stop_at = time.perf_counter() + args.duration
+
+    async def worker():
+        while time.perf_counter() < stop_at:
+            i = next(counter)
+            if args.requests and i >= args.requests:
+                return
+            await _send(client, url, frames, i, args, stats, time.perf_counter())
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def run_open_loop(client, url, frames, args, stats: Stats):
+    interval = 1.0 / args.rate
+    start = time.perf_counter()
+    tasks = []
+    i = 0
+    while True:
+        t_intended = start + i * interval
+        if t_intended - start >= args.duration or (args.requests and i >= args.requests):
+            break
+        delay = t_intended - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_send(client, url, frames, i, args, stats, t_intended)))
+        i += 1
+    await asyncio.gather(*tasks)
+
+
+# ===================== 리포트 =====================
+def percentile(sorted_vals, q: float) -> float:
+    if not sorted_vals:
+        return float("nan")
+    k = (len(sorted_vals) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def print_report(stats: Stats, elapsed: float, args):
+    total = stats.ok + stats.errors
+    mode = f"open-loop rate={args.rate}/s" if args.rate else f"closed-loop concurrency={args.concurrency}"
+    print(f"\n=== {args.endpoint} | {mode} | {elapsed:.1f}s ===")
+    print(f"requests : {total}  ok={stats.ok}  errors={stats.errors} ({(stats.errors / total * 100) if total else 0:.2f}%)")
+    if stats.error_kinds:
+        print(f"errors   : {stats.error_kinds}")
+    print(f"throughput: {stats.ok / elapsed:.2f} req/s, {stats.images / elapsed:.2f} img/s")
+
+    print(f"\n{'latency (ms)':<22}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for title, vals in (("client (per request)", stats.latencies), ("server latency_ms", stats.server_latencies)):
+        v = sorted(vals)
+        if not v:
+            continue
+        row = [percentile(v, q) for q in (0.5, 0.9, 0.95, 0.99)] + [v[-1]]
+        print(f"{title:<22}" + "".join(f"{x:>9.1f}" for x in row))
+
+
+async def main_async(args):
+    if args.inproc:
+        base = start_inproc_server(args.standin_backbone, args.standin_img, args.standin_yolo)
+    else:
+        base = args.url.rstrip("/")
+
+    if args.frames and Path(args.frames).exists():
+        frames = load_frames(args.frames, args.limit)
+    else:
+        frames = synthetic_frames(args.synthetic)
+    if not frames:
+        print("[WARN] 보낼 프레임이 없음")
+        return 1
+    print(f"[INFO] frames={len(frames)} target={base}{args.endpoint}")
+
+    url = base + args.endpoint
+    stats = Stats()
+    limits = httpx.Limits(max_connections=max(args.concurrency, 64))
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        # 워밍업 (집계 제외)
+        for i in range(args.warmup):
+            await _send(client, url, frames, i, args, Stats(), time.perf_counter())
+
+        start = time.perf_counter()
+        if args.rate:
+            await run_open_loop(client, url, frames, args, stats)
+        else:
+            await run_closed_loop(client, url, frames, args, stats)
+        elapsed = time.perf_counter() - start
+
+    print_report(stats, elapsed, args)
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="AI 서버 부하 테스트")
+    ap.add_argument("--url", default="http://localhost:8000")
+    ap.add_argument("--endpoint", choices=["/predict", "/predict_batch"], default="/predict")
+    ap.add_argument("--batch-size", type=int, default=8, help="/predict_batch 요청당 이미지 수")
+    ap.add_argument("--frames", default="frames_all", help="재생할 프레임 폴더 (없으면 랜덤 JPEG)")
+    ap.add_argument("--limit", type=int, default=0, help="사용할 프레임 수 상한 (0=전부)")
+    ap.add_argument("--synthetic", type=int, default=16, help="랜덤 JPEG 개수")
+    ap.add_argument("--rate", type=float, default=0.0, help="open-loop 초당 요청 수 (0이면 closed-loop)")
+    ap.add_argument("--concurrency", type=int, default=1, help="closed-loop 동시 요청 수")
+    ap.add_argument("--duration", type=float, default=30.0, help="측정 시간 (초)")
+    ap.add_argument("--requests", type=int, default=0, help="최대 요청 수 (0=시간 기준)")
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=10.0, help="라즈베리파이 업로더 REQUEST_TIMEOUT과 동일")
+    ap.add_argument("--inproc", action="store_true", help="랜덤 가중치 모델로 서버를 프로세스 안에서 실행")
+    ap.add_argument("--standin-backbone", default="mobilenetv3_small_050")
+    ap.add_argument("--standin-img", type=int, default=128)
+    ap.add_argument("--standin-yolo", default="yolov8n.yaml")
+    args = ap.parse_args()
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,58 @@
+# quantize_mt.py
+# 멀티태스크 모델 정적 INT8 PTQ: 보정용 프레임 폴더로 activation 범위를 잡고
+# ckpt 옆에 <ckpt>.int8.ts 로 저장 → 서버에서 QUANT_MODE=static 으로 사용
+#   python quantize_mt.py frames_all --limit 200
+#   python eval_folders.py --quant static   # fp32 대비 혼동행렬 비교
+import argparse
+from pathlib import Path
+
+import torch
+
+import test as server  # AI 서버 모듈 (모델/전처리 그대로 재사용)
+
+
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def calib_batches(paths, batch_size: int):
+    """서버와 같은 디코딩 + TTA 뷰로 보정 배치 생성"""
+    buf = []
+    for p in paths:
+        img = server.decode_image(p.read_bytes())
+        buf.append(server.build_tta_batch(img))
+        if len(buf) == batch_size:
+            yield torch.cat(buf, 0)
+            buf = []
+    if buf:
+        yield torch.cat(buf, 0)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("calib_dir", type=Path)
+    ap.add_argument("--limit", type=int, default=200)
+    ap.add_argument("--batch", type=int, default=4)
+    args = ap.parse_args()
+
+    paths = sorted(p for p in args.calib_dir.rglob("*") if p.suffix.lower() in IMG_EXTS)
+    if args.limit > 0:
+        paths = paths[:args.limit]
+    if not paths:
+        print(f"[WARN] {args.calib_dir} 에 이미지 없음")
+        return 1
+    server.load_models()
+    print(f"calibration images: {len(paths)}, engine={server.QUANT_ENGINE}")
+
+    qnet = server.quantize_static(server.model, calib_batches(paths, args.batch))
+
+    out_path = server.quant_artifact_path(server.CKPT_PATH)
+    example = torch.zeros(1, 3, server.IMG_SIZE, server.IMG_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.trace(qnet, example)
+    traced.save(out_path)
+    print(f"[OK] saved {out_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,115 @@
+# rescore_features.py
+# 특징 저장소(FEATURE_STORE_DIR)에 쌓인 TTA 평균 백본 특징으로 헤드만 다시 실행 → 백본 forward 없이 재평가
+#   - 새로 학습한 헤드(ckpt의 head_type.* / head_def.*)나 임계값 변경이 판정을 얼마나 바꾸는지 수백만 장 단위로 확인
+#   - --baseline: 기존 헤드와 판정 비교 (라벨 전이 표)
+#   - 헤드만 다시 학습한 ckpt 전용: 백본 가중치 digest가 저장소(<backbone>.json weights)와 다르면 중단
+#
+#   python rescore_features.py --store feature_store --ckpt runs_mt_v3/inductor_mt_best.pt
+#   python rescore_features.py --store feature_store --ckpt new.pt --baseline runs_mt_v2/inductor_mt_best.pt --out logits.npy
+import argparse
+import collections
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import test as server  # AI 서버 모듈 (FeatureStore, ckpt 로더 재사용)
+from eval_folders import LABELS, decide_np  # 판정 규칙은 eval_folders와 공유
+
+
+def load_heads(path: str):
+    """→ (backbone, 백본 가중치 digest, threshold_defect, {head_type.weight, ...}) float32. safetensors / .pt 모두"""
+    meta, sd = server.load_mt_weights(path)
+    heads = {k: sd[k].float() for k in ("head_type.weight", "head_type.bias", "head_def.weight", "head_def.bias")}
+    return meta["backbone"], server.FeatureStore.weights_digest(sd), float(meta["threshold_defect"]), heads
+
+
+def open_store(root: str, backbone: str):
+    """→ (keys, feats memmap, 특징을 만든 백본 가중치 digest)"""
+    feat_path, keys_path, meta_path = server.FeatureStore.paths(root, backbone)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    dim, weights = meta["dim"], meta.get("weights")
+    keys = server.FeatureStore.read_keys(keys_path)
+    if not keys:
+        return [], np.zeros((0, dim), dtype=np.float16), weights
+    feats = np.memmap(feat_path, dtype=np.float16, mode="r")
+    n = min(len(keys), feats.size // dim)
+    return keys[:n], feats[:n * dim].reshape(n, dim), weights
+
+
+@torch.inference_mode()
+def score(feats: np.ndarray, heads: dict, chunk: int) -> np.ndarray:
+    """→ (N, 3) [type_101, type_701, defect] logit. memmap을 chunk 행씩 읽어 Linear 두 개만 실행"""
+    w = torch.cat([heads["head_type.weight"], heads["head_def.weight"]], 0)   # (3, D)
+    b = torch.cat([heads["head_type.bias"], heads["head_def.bias"]], 0)
+    out = np.empty((feats.shape[0], 3), dtype=np.float32)
+    for i in range(0, feats.shape[0], chunk):
+        x = torch.from_numpy(np.asarray(feats[i:i + chunk], dtype=np.float32))
+        out[i:i + chunk] = F.linear(x, w, b).numpy()
+    return out
+
+
+def thresholds(base_t: float, high, low):
+    # 서버와 같은 기본값: HIGH = ckpt threshold_defect, LOW = HIGH - 0.02
+    high = base_t if high is None else high
+    low = max(0.0, high - 0.02) if low is None else low
+    return high, low
+
+
+def main():
+    ap = argparse.ArgumentParser(description="저장된 백본 특징으로 헤드 재평가")
+    ap.add_argument("--store", default=server.FEATURE_STORE_DIR or "feature_store")
+    ap.add_argument("--ckpt", required=True, help="새 헤드가 들어 있는 멀티태스크 ckpt (.pt / .safetensors)")
+    ap.add_argument("--baseline", default=None, help="비교할 기존 ckpt (기본: 비교 안 함)")
+    ap.add_argument("--thresh-high", type=float, default=None)
+    ap.add_argument("--thresh-low", type=float, default=None)
+    ap.add_argument("--chunk", type=int, default=65536, help="한 번에 읽을 특징 행 수")
+    ap.add_argument("--out", default=None, help="새 헤드 logit 저장 (.npy, 행 순서 = <backbone>.keys)")
+    args = ap.parse_args()
+
+    backbone, weights, base_t, heads = load_heads(args.ckpt)
+    keys, feats, store_weights = open_store(args.store, backbone)
+    if not keys:
+        print(f"[WARN] {args.store} 에 {backbone} 특징 없음")
+        return 1
+    if store_weights != weights:
+        # 백본이 다시 학습된 ckpt → 저장된 특징과 헤드 입력 분포가 다름
+        print(f"[ERROR] 저장된 특징의 백본 가중치({store_weights})가 {args.ckpt}({weights})와 다름")
+        return 1
+    high, low = thresholds(base_t, args.thresh_high, args.thresh_low)
+    print(f"features: {len(keys)} x {feats.shape[1]} ({backbone}), high={high:.3f} low={low:.3f}")
+
+    t = time.perf_counter()
+    logits = score(feats, heads, args.chunk)
+    pred = decide_np(logits, high, low)
+    print(f"rescored in {time.perf_counter() - t:.2f}s")
+
+    counts = collections.Counter(pred.tolist())
+    print("\n=== 판정 분포 ===")
+    for i, label in enumerate(LABELS):
+        print(f"{label:<10}{counts.get(i, 0):>12}  ({counts.get(i, 0) / len(pred) * 100:.2f}%)")
+
+    if args.baseline:
+        b_backbone, b_weights, b_t, b_heads = load_heads(args.baseline)
+        if b_backbone != backbone or b_weights != weights:
+            print(f"[WARN] baseline 백본({b_backbone}, {b_weights})이 저장된 특징과 다름, 비교 생략")
+        else:
+            b_pred = decide_np(score(feats, b_heads, args.chunk), *thresholds(b_t, args.thresh_high, args.thresh_low))
+            m = np.zeros((len(LABELS), len(LABELS)), dtype=np.int64)
+            np.add.at(m, (b_pred, pred), 1)
+            print(f"\n=== baseline → new (바뀐 판정 {int((b_pred != pred).sum())}건) ===")
+            print(f"{'':<10}" + "".join(f"{label:>10}" for label in LABELS))
+            for i, label in enumerate(LABELS):
+                print(f"{label:<10}" + "".join(f"{v:>10}" for v in m[i]))
+
+    if args.out:
+        np.save(args.out, logits)
+        print(f"[OK] saved {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
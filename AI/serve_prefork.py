@@ -0,0 +1,157 @@
+# serve_prefork.py
+# pre-fork 멀티 워커 실행: 부모가 모델을 한 번만 로드한 뒤 fork → 워커들이 가중치를 copy-on-write로 공유
+#   - uvicorn --workers N 은 워커마다 backbone + YOLO를 따로 로드 (메모리 N배)
+#   - 여기서는 부모가 listen 소켓도 만들어서 워커들이 같은 포트를 같이 accept
+#   - 주기적으로 워커별 메모리(smaps_rollup) 출력: private = 워커 1개 추가 비용
+#   - /admin/swap은 어느 워커가 받든 공유 파일(--swap-sync)에 기록 → 모든 워커가 폴링해서 같은 모델로 교체
+#
+#   python serve_prefork.py --workers 4 --port 8000
+#   python serve_prefork.py --workers 4 --share shm   # 가중치를 /dev/shm으로 옮겨 명시적으로 공유
+import argparse
+import gc
+import os
+import signal
+import socket
+import tempfile
+import time
+
+import torch
+import uvicorn
+
+import test as server  # AI 서버 모듈
+
+
+def prime_for_fork(share: str):
+    """fork 전에 가중치/지연 초기화 상태를 부모에서 만들어 둠 (워커에서 새로 쓰면 페이지가 복사됨)"""
+    torch.set_num_threads(1)  # 부모는 intra-op 스레드 풀을 만들지 않음 (fork 후 OpenMP 데드락 방지)
+    server.load_models()
+
+    if share == "shm":
+        for t in list(server.model.parameters()) + list(server.model.buffers()):
+            t.share_memory_()
+        yolo_net = getattr(server.yolo_model, "model", None)
+        if isinstance(yolo_net, torch.nn.Module):
+            for t in list(yolo_net.parameters()) + list(yolo_net.buffers()):
+                t.share_memory_()
+
+    # ultralytics는 첫 predict에서 predictor 생성 + conv/bn fuse → 부모에서 1장으로 미리 실행
+    with torch.inference_mode():
+        server.mt_backend(torch.zeros(1, 3, server.IMG_SIZE, server.IMG_SIZE, device=server.DEVICE))
+    from PIL import Image
+    server.yolo_model.predict(Image.new("RGB", (server.IMG_SIZE, server.IMG_SIZE)),
+                              imgsz=server.YOLO_IMGSZ, verbose=False)
+
+    # 이후 생성된 객체들은 GC가 건드리지 않게 → refcount/GC 헤더 쓰기로 인한 CoW 복사 감소
+    gc.collect()
+    gc.freeze()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket, log_level: str):
+    """자식 프로세스: 로드는 생략되고(load_models는 이미 완료) 워밍업만 워커별로 실행"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(server.app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+    os._exit(0)
+
+
+def spawn(sock, log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock, log_level)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def print_memory(parent_pid: int, workers):
+    print(f"\n{'process':<16}{'rss':>10}{'pss':>10}{'shared':>10}{'private':>10}  (MB)")
+    rows = [("parent", parent_pid)] + [(f"worker {pid}", pid) for pid in workers]
+    for name, pid in rows:
+        m = server.process_memory(pid)
+        if m:
+            print(f"{name:<16}{m['rss']:>10.1f}{m['pss']:>10.1f}{m['shared']:>10.1f}{m['private']:>10.1f}")
+    privates = [server.process_memory(pid).get("private", 0.0) for pid in workers]
+    if privates:
+        print(f"per extra worker ≈ {sum(privates) / len(privates):.1f} MB private")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="AI 서버 pre-fork 실행 (가중치 공유)")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--share", choices=["cow", "shm"], default="cow",
+                    help="cow: fork copy-on-write / shm: 텐서를 공유 메모리로 옮긴 뒤 fork")
+    ap.add_argument("--report-interval", type=float, default=60.0, help="메모리 리포트 주기 (초, 0=끄기)")
+    ap.add_argument("--log-level", default="info")
+    ap.add_argument("--swap-sync", default=None,
+                    help="워커 간 /admin/swap 공유 파일 (기본: SWAP_SYNC_FILE 또는 임시 폴더의 ai_swap_<pid>.json)")
+    args = ap.parse_args()
+
+    # fork 전에 지정해야 모든 워커가 같은 파일을 폴링. 이전 실행의 요청은 지움 (부모가 로드한 모델이 기준)
+    server.SWAP_SYNC_FILE = args.swap_sync or server.SWAP_SYNC_FILE or os.path.join(
+        tempfile.gettempdir(), f"ai_swap_{os.getpid()}.json")
+    for path in (server.SWAP_SYNC_FILE, server.SWAP_SYNC_FILE + ".lock"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    t0 = time.perf_counter()
+    prime_for_fork(args.share)
+    print(f"[INFO] parent loaded models in {time.perf_counter() - t0:.1f}s "
+          f"(share={args.share}), forking {args.workers} workers")
+
+    sock = bind_socket(args.host, args.port)
+    workers = {spawn(sock, args.log_level) for _ in range(args.workers)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    next_report = time.monotonic() + args.report_interval
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.discard(pid)
+            if not stopping:
+                # 죽은 워커는 다시 fork (부모 가중치는 그대로라 재로드 없음)
+                print(f"[WARN] worker {pid} exited ({status}), respawning")
+                workers.add(spawn(sock, args.log_level))
+            continue
+        if args.report_interval > 0 and time.monotonic() >= next_report:
+            print_memory(os.getpid(), workers)
+            next_report = time.monotonic() + args.report_interval
+        time.sleep(0.5)
+
+    sock.close()
+    for path in (server.SWAP_SYNC_FILE, server.SWAP_SYNC_FILE + ".lock"):
+        if os.path.exists(path):
+            os.remove(path)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,30 +1,140 @@
 # app.py
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, Header, Request, Response, Query, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Dict, Optional
-import io, os, time, json, datetime
+import io, os, time, json, datetime, asyncio, collections, functools, math, hashlib, copy, random, threading, queue, contextlib, gc, uuid, tempfile, shutil
+import fcntl
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 from torch import nn
 import torch.nn.functional as F
 from torchvision import transforms
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import timm
+from safetensors import safe_open
+from safetensors.torch import load_file as load_safetensors, save_file as save_safetensors
 
 # YOLO (ultralytics)
 from ultralytics import YOLO
 
+# 메트릭 (Prometheus)
+from prometheus_client import Histogram, Counter, Gauge, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+
 # 외부 통신
 import httpx
 import paho.mqtt.client as mqtt
 
+PROCESS_START = time.time()  # 콜드 스타트 측정 기준
+
 # ===================== Config =====================
 CKPT_PATH = os.getenv("CKPT_PATH", "runs_mt_v2/inductor_mt_best.pt")  # 멀티태스크 ckpt
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 YOLO_MODEL_PATH = os.getenv("YOLO_MODEL_PATH", "best.pt")
 YOLO_CONF_DEFECT = float(os.getenv("YOLO_CONF_DEFECT", "0.5"))
+YOLO_IMGSZ = int(os.getenv("YOLO_IMGSZ", "640"))
+
+# 추론 엔진: torch(eager) | torchscript | onnx. export 결과물은 각 체크포인트 옆에 캐시
+INFER_BACKEND = os.getenv("INFER_BACKEND", "torch")
+
+# 멀티태스크 INT8 양자화 (CPU 전용): none | dynamic(Linear 헤드) | static(백본 PTQ, quantize_mt.py로 사전 보정)
+QUANT_MODE = os.getenv("QUANT_MODE", "none")
+QUANT_ENGINE = os.getenv("QUANT_ENGINE", "x86")   # x86 | fbgemm | qnnpack(ARM)
+
+# JPEG draft(1/2, 1/4, 1/8 축소 디코딩)로 전처리 base 크기 근처까지만 디코딩
+PREPROC_DRAFT = os.getenv("PREPROC_DRAFT", "1") == "1"
+
+# TTA 뷰(전처리 2종 × 좌우반전)를 한 번의 forward로 묶을지 여부 (0이면 기존 뷰별 forward)
+TTA_BATCHED = os.getenv("TTA_BATCHED", "1") == "1"
+
+# CPU 최적화 입력 경로: channels_last 모델 + uint8→float 정규화 한 번에 + 최대 배치 크기 입력 버퍼 재사용
+#   버퍼는 추론 워커당 1쌍 (uint8 + float32, max_batch × TTA 뷰 × 3 × IMG × IMG)
+CPU_OPT = os.getenv("CPU_OPT", "0") == "1"
+
+# 적응형 TTA: center 뷰 1회로 판정이 확실하면 나머지 뷰 생략
+#   p_def가 [THRESH_LOW - MARGIN, THRESH_HIGH + MARGIN) 안이거나 101/701 확률 차가 TYPE_MARGIN 미만이면 전체 TTA
+TTA_ADAPTIVE = os.getenv("TTA_ADAPTIVE", "0") == "1"
+TTA_EARLY_MARGIN = float(os.getenv("TTA_EARLY_MARGIN", "0.1"))
+TTA_TYPE_MARGIN = float(os.getenv("TTA_TYPE_MARGIN", "0.2"))
+
+# /predict 마이크로배칭: 동시에 들어온 요청을 최대 MAX_WAIT_MS 동안 / MAX_BATCH개까지 모아 한 번에 추론
+MICROBATCH_ENABLED = os.getenv("MICROBATCH_ENABLED", "1") == "1"
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", "5"))
+MICROBATCH_MAX_BATCH = int(os.getenv("MICROBATCH_MAX_BATCH", "8"))
+
+# 추론 전용 스레드 풀 크기 (torch/ultralytics 동기 추론을 이벤트 루프 밖에서 실행)
+INFER_WORKERS = int(os.getenv("INFER_WORKERS", "1"))
+
+# 워밍업할 배치 크기 목록 (예: "1,2,4,8,16"). 비우면 마이크로배치/predict_batch 최대 크기까지 2의 거듭제곱 + 최대값
+WARMUP_BATCH_SIZES = os.getenv("WARMUP_BATCH_SIZES", "")
+WARMUP_FRAME_SIZE = (1920, 1080)  # mqtt_camera_uploader CAM_WIDTH x CAM_HEIGHT
+
+# 입장 제어: 예상 대기(처리 중 이미지 수 × 이미지당 처리 시간 / 추론 워커 수)가 예산을 넘으면 429,
+# 처리 중 이미지가 상한을 넘으면 503 (둘 다 Retry-After). 업로더 REQUEST_TIMEOUT(10초) 전에 거절하도록. 예산 0이면 비활성
+ADMISSION_BUDGET_MS = float(os.getenv("ADMISSION_BUDGET_MS", "7000"))
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "128"))
+
+# 백본 특징 저장소: 전체 TTA 배치 경로(eager)에서 이미지별 TTA 평균 pooled 특징을 <DIR>/<backbone>.f16에 append
+# (키 = 업로드 바이트 sha256). rescore_features.py로 새 헤드/임계값을 백본 없이 재평가. 비우면 비활성
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "")
+
+# /admin/* 호출 시 필요한 X-Admin-Token 헤더 값 (비우면 /admin/* 비활성 → 403)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# 멀티 워커(serve_prefork.py) 모델 교체 공유 파일: /admin/swap은 여기에 요청만 기록하고 모든 워커가 폴링해서 같은 교체를 적용
+# 비우면 요청을 받은 프로세스만 교체 (단일 프로세스 uvicorn)
+SWAP_SYNC_FILE = os.getenv("SWAP_SYNC_FILE", "")
+SWAP_SYNC_POLL_S = float(os.getenv("SWAP_SYNC_POLL_S", "1.0"))
+
+# 결과 캐시: 이미지 내용 해시 + 모델 버전 키, LRU 최대 개수/TTL(초). SIZE=0이면 비활성
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "30"))
+
+# /predict_batch: 업로드 병렬 디코딩 스레드 수, 모델 1회 배치 최대 크기(피크 메모리 상한)
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "4"))
+PREDICT_BATCH_MAX = int(os.getenv("PREDICT_BATCH_MAX", "16"))
+
+# /ws/predict: 결과를 돌려주기 전까지 동시에 처리 중일 수 있는 최대 이미지 수 (초과 시 소켓 읽기 중단)
+STREAM_WINDOW = int(os.getenv("STREAM_WINDOW", "8"))
+
+# 멀티태스크/YOLO 동시 실행: YOLO를 전용 워커로 분리
+# torch(OpenMP) intra-op 스레드 수는 스레드별 설정 → 추론 워커는 MT_THREADS, YOLO 워커는 YOLO_THREADS로 각자 지정
+#   (PARALLEL_MODELS=0이면 YOLO도 추론 워커에서 MT_THREADS로 실행). 전체 ≈ INFER_WORKERS × (MT_THREADS + YOLO_THREADS)
+# (ONNX Runtime 멀티태스크 세션은 자체 스레드 풀이라 MT_THREADS가 그대로 적용)
+PARALLEL_MODELS = os.getenv("PARALLEL_MODELS", "0") == "1"
+MT_THREADS = int(os.getenv("MT_THREADS", "1"))
+YOLO_THREADS = int(os.getenv("YOLO_THREADS", "1"))
+
+# 캐스케이드: 멀티태스크 p_def가 [CASCADE_P_LOW, CASCADE_P_HIGH] 안일 때만 YOLO 실행
+# CASCADE_AUDIT_RATES: 최종 라벨별 강제 YOLO 감사 비율, 예) "101_top=0.05,701_top=0.05,defect=0.2"
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0") == "1"
+CASCADE_P_LOW = float(os.getenv("CASCADE_P_LOW", "0.2"))
+CASCADE_P_HIGH = float(os.getenv("CASCADE_P_HIGH", "0.8"))
+
+def _parse_rates(s: str) -> Dict[str, float]:
+    rates = {}
+    for kv in s.split(","):
+        if "=" in kv:
+            k, v = kv.split("=", 1)
+            rates[k.strip()] = float(v)
+    return rates
+
+CASCADE_AUDIT_RATES = _parse_rates(os.getenv("CASCADE_AUDIT_RATES", ""))
+
+# 2단계 ROI: YOLO로 부품 위치를 먼저 찾고 멀티태스크는 박스 주변 크롭에서 실행 (같은 base 이미지, YOLO 결과 재사용)
+# 켜면 YOLO가 항상 먼저 실행되므로 CASCADE_ENABLED / PARALLEL_MODELS보다 우선
+ROI_CROP = os.getenv("ROI_CROP", "0") == "1"
+ROI_CLASSES = {int(c) for c in os.getenv("ROI_CLASSES", "0").split(",") if c.strip()}  # 부품 위치로 쓸 YOLO 클래스
+ROI_CONF = float(os.getenv("ROI_CONF", "0.25"))          # 부품 박스 최소 conf (불량 판정은 YOLO_CONF_DEFECT 그대로)
+ROI_PAD = float(os.getenv("ROI_PAD", "0.15"))            # 박스 긴 변 대비 사방 여백 비율
+ROI_BASE_LONG = int(os.getenv("ROI_BASE_LONG", "1280"))  # ROI 모드 base 이미지 긴 변 (크롭 해상도 확보)
+# 다중 부품 (ROI_CROP=1일 때): 프레임의 부품 박스를 전부(최대 ROI_MAX_PARTS개) 크롭해 한 번의 배치로 분류 → 부품별 parts
+ROI_MULTI = os.getenv("ROI_MULTI", "0") == "1"
+ROI_MAX_PARTS = int(os.getenv("ROI_MAX_PARTS", "8"))
 
 # 결과 전달 대상
 SPRING_NOTIFY_URL = os.getenv("SPRING_NOTIFY_URL", "")  # 예: http://<spring-host>:8080/api/infer/result
@@ -35,6 +145,49 @@ MQTT_TOPIC = os.getenv("MQTT_TOPIC", "factory/inductor/result")
 MQTT_QOS = int(os.getenv("MQTT_QOS", "1"))
 MQTT_USERNAME = os.getenv("MQTT_USERNAME", "")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "")
+MQTT_MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", "20"))  # QoS>0 미확인 메시지 상한
+
+# 결과 전송 큐 (스프링/MQTT 각각): 대기 최대 수, 묶음 대기(ms), 재시도 횟수와 지수 백오프(초)
+# 큐가 차거나 재시도를 다 써도 실패하면 NOTIFY_SPILL_DIR/<sink>.jsonl 에 저장 → 전송 재개되면 다시 보냄 (비우면 버림)
+NOTIFY_QUEUE_MAX = int(os.getenv("NOTIFY_QUEUE_MAX", "1000"))
+NOTIFY_BATCH_WAIT_MS = float(os.getenv("NOTIFY_BATCH_WAIT_MS", "20"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "5"))
+NOTIFY_BACKOFF_BASE_S = float(os.getenv("NOTIFY_BACKOFF_BASE_S", "0.5"))
+NOTIFY_BACKOFF_MAX_S = float(os.getenv("NOTIFY_BACKOFF_MAX_S", "30"))
+NOTIFY_SPILL_DIR = os.getenv("NOTIFY_SPILL_DIR", "notify_spill")
+# 스프링 POST 1번에 담을 결과 수. 1이면 기존처럼 결과 객체 1개, 2 이상이면 JSON 배열로 묶어서 POST
+SPRING_BATCH_MAX = int(os.getenv("SPRING_BATCH_MAX", "1"))
+
+# ===================== Metrics =====================
+# 단계별 지연(ms) 히스토그램 + 최근 METRICS_WINDOW건 기준 p50/p95/p99 게이지
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "2048"))
+STAGES = ("receive", "decode", "preprocess", "mt_forward", "yolo_forward", "postprocess", "dispatch")
+
+STAGE_LATENCY = Histogram(
+    "ai_stage_latency_ms", "AI 서버 단계별 처리 시간 (ms)", ["stage"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 2000, 5000),
+)
+PREDICTIONS = Counter("ai_predictions_total", "최종 라벨별 판정 수", ["final"])
+_stage_window = {stage: collections.deque(maxlen=METRICS_WINDOW) for stage in STAGES}
+
+def observe(stage: str, ms: float):
+    STAGE_LATENCY.labels(stage).observe(ms)
+    _stage_window[stage].append(ms)
+
+class _StageQuantiles:
+    """스크레이프 시점에 최근 구간 분위수 계산 (히스토그램 버킷 보간 없이 바로 보기 위함)"""
+    def collect(self):
+        g = GaugeMetricFamily("ai_stage_latency_quantile_ms", "최근 METRICS_WINDOW건 기준 단계별 지연 분위수 (ms)",
+                              labels=["stage", "quantile"])
+        for stage, win in _stage_window.items():
+            vals = sorted(list(win))
+            if not vals:
+                continue
+            for q in (0.5, 0.95, 0.99):
+                g.add_metric([stage, str(q)], vals[min(len(vals) - 1, int(q * len(vals)))])
+        yield g
+
+REGISTRY.register(_StageQuantiles())
 
 # ===================== Multitask Model ======================
 class InductorMT(nn.Module):
@@ -52,30 +205,214 @@ class InductorMT(nn.Module):
 
 def load_ckpt(path: str):
     try:
-        ckpt = torch.load(path, map_location="cpu", weights_only=True)
-    except TypeError:
-        ckpt = torch.load(path, map_location="cpu")
+        ckpt = torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+    except (TypeError, RuntimeError):
+        # mmap 미지원 torch 또는 zip 포맷이 아닌 ckpt → mmap만 빼고 다시 (weights_only는 유지)
+        try:
+            ckpt = torch.load(path, map_location="cpu", weights_only=True)
+        except TypeError:
+            ckpt = torch.load(path, map_location="cpu")  # weights_only 인자가 없는 구버전 torch
     return ckpt
 
-ckpt = load_ckpt(CKPT_PATH)
-BACKBONE = ckpt.get("backbone", "efficientnet_b2")
-IMG_SIZE = int(ckpt.get("img", 384))
-BASE_T_DEF = float(ckpt.get("threshold_defect", 0.5))
+def _ckpt_meta(ckpt: dict) -> Dict[str, str]:
+    return {
+        "backbone": str(ckpt.get("backbone", "efficientnet_b2")),
+        "img": str(int(ckpt.get("img", 384))),
+        "threshold_defect": str(float(ckpt.get("threshold_defect", 0.5))),
+    }
+
+def load_mt_weights(path: str):
+    """
+    → (meta, state_dict). ckpt 옆 .safetensors(메타데이터 포함)를 mmap으로 로드.
+    없거나 ckpt보다 오래됐으면 ckpt에서 한 번 변환해 저장 (저장 불가 시 ckpt 직접 사용).
+    """
+    st_path = path if path.endswith(".safetensors") else _artifact_path(path, ".safetensors")
+    if not _is_fresh(st_path, path):
+        ckpt = load_ckpt(path)
+        meta = _ckpt_meta(ckpt)
+        try:
+            save_safetensors({k: v.contiguous() for k, v in ckpt["state_dict"].items()}, st_path, metadata=meta)
+            print(f"[INFO] safetensors written: {st_path}")
+        except Exception as e:
+            print(f"[WARN] safetensors convert failed ({e}), using {path}")
+            return meta, ckpt["state_dict"]
+    with safe_open(st_path, framework="pt") as f:
+        meta = f.metadata()
+    return meta, load_safetensors(st_path, device="cpu")
+
+def build_mt_model(backbone: str, state_dict) -> "InductorMT":
+    """meta 디바이스에 뼈대만 만들고 로드한 텐서를 그대로 붙임(assign) → 랜덤 초기화/가중치 복사 생략"""
+    try:
+        with torch.device("meta"):
+            net = InductorMT(backbone)
+        net.load_state_dict(state_dict, strict=True, assign=True)
+    except Exception:
+        net = InductorMT(backbone)
+        net.load_state_dict(state_dict, strict=True)
+    return net.to(DEVICE).eval()
+
+# 아래 값들은 load_models()에서 채워짐 (서버는 백그라운드 로딩, /ready 참고)
+BACKBONE: Optional[str] = None
+IMG_SIZE: Optional[int] = None
+BASE_T_DEF: Optional[float] = None
+THRESH_HIGH: Optional[float] = None
+THRESH_LOW: Optional[float] = None
+model: Optional[InductorMT] = None
+
+# ===================== Inference Backends =====================
+def _artifact_path(src_path: str, suffix: str) -> str:
+    return os.path.splitext(src_path)[0] + suffix
+
+def _is_fresh(artifact: str, src_path: str) -> bool:
+    return os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(src_path)
+
+class EagerMT:
+    """기본 PyTorch eager 실행"""
+    name = "torch"
+
+    def __init__(self, net: nn.Module):
+        self.net = net
+        self.path = None
+
+    def __call__(self, x: torch.Tensor):
+        with torch.cuda.amp.autocast(enabled=(DEVICE.type == "cuda")):
+            return self.net(x)
+
+    def with_features(self, x: torch.Tensor):
+        """forward와 같은 출력 + pooled 백본 특징 h (특징 저장소용)"""
+        with torch.cuda.amp.autocast(enabled=(DEVICE.type == "cuda")):
+            h = self.net.backbone(x)
+            return self.net.head_type(h), self.net.head_def(h).squeeze(1), h
 
-THRESH_HIGH = float(os.getenv("THRESH_HIGH", BASE_T_DEF))
-THRESH_LOW  = float(os.getenv("THRESH_LOW", max(0.0, BASE_T_DEF - 0.02)))
+class TorchScriptMT:
+    """torch.jit.trace로 고정한 그래프 (ckpt 옆 .ts 파일로 캐시)"""
+    name = "torchscript"
 
-model = InductorMT(BACKBONE)
-_ = model.load_state_dict(ckpt["state_dict"], strict=True)
-model.to(DEVICE).eval()
+    def __init__(self, net: nn.Module, src_path: str, img_size: Optional[int] = None):
+        s = img_size or IMG_SIZE
+        self.path = _artifact_path(src_path, ".ts")
+        if not _is_fresh(self.path, src_path):
+            example = mt_input(torch.zeros(2, 3, s, s, device=DEVICE))
+            with torch.no_grad():
+                traced = torch.jit.trace(net, example)
+            traced.save(self.path)
+            print(f"[INFO] TorchScript exported: {self.path}")
+        self.net = torch.jit.freeze(torch.jit.load(self.path, map_location=DEVICE).eval())
+
+    def __call__(self, x: torch.Tensor):
+        return self.net(x)
+
+class OnnxMT:
+    """ONNX Runtime 세션 (ckpt 옆 .onnx 파일로 캐시, 배치 축은 동적)"""
+    name = "onnx"
+
+    def __init__(self, net: nn.Module, src_path: str, img_size: Optional[int] = None):
+        import onnxruntime as ort  # INFER_BACKEND=onnx 일 때만 필요
+
+        s = img_size or IMG_SIZE
+        self.path = _artifact_path(src_path, ".onnx")
+        if not _is_fresh(self.path, src_path):
+            example = torch.zeros(1, 3, s, s, device=DEVICE)
+            torch.onnx.export(
+                net, example, self.path,
+                input_names=["x"], output_names=["type_logits", "def_logit"],
+                dynamic_axes={"x": {0: "n"}, "type_logits": {0: "n"}, "def_logit": {0: "n"}},
+                opset_version=17,
+            )
+            print(f"[INFO] ONNX exported: {self.path}")
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = max(1, MT_THREADS)
+        providers = ["CPUExecutionProvider"]
+        if DEVICE.type == "cuda":
+            providers.insert(0, "CUDAExecutionProvider")
+        self.sess = ort.InferenceSession(self.path, sess_options=so, providers=providers)
+
+    def __call__(self, x: torch.Tensor):
+        type_logits, def_logit = self.sess.run(None, {"x": x.detach().cpu().contiguous().numpy()})
+        return torch.from_numpy(type_logits).to(x.device), torch.from_numpy(def_logit).to(x.device)
+
+def build_mt_backend(name: str, net: nn.Module, src_path: str, img_size: Optional[int] = None):
+    if name == "torchscript":
+        return TorchScriptMT(net, src_path, img_size)
+    if name == "onnx":
+        return OnnxMT(net, src_path, img_size)
+    return EagerMT(net)
+
+mt_backend = None  # load_models()
+
+# ===================== INT8 Quantization =====================
+def quantize_dynamic_heads(net: nn.Module) -> nn.Module:
+    """head_type/head_def Linear만 동적 INT8 양자화 (보정 불필요)"""
+    net = copy.deepcopy(net).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+
+def quantize_static(net: nn.Module, calib_batches) -> nn.Module:
+    """백본은 FX 그래프 모드 정적 PTQ(calib_batches로 activation 범위 보정), 헤드는 동적 양자화"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = QUANT_ENGINE
+    net = copy.deepcopy(net).cpu().eval()
+    example = (torch.zeros(1, 3, IMG_SIZE, IMG_SIZE),)
+    prepared = prepare_fx(net.backbone, get_default_qconfig_mapping(QUANT_ENGINE), example)
+    with torch.no_grad():
+        for x in calib_batches:
+            prepared(x.cpu())
+    net.backbone = convert_fx(prepared)
+    return torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+
+def quant_artifact_path(src_path: str) -> str:
+    return _artifact_path(src_path, ".int8.ts")
+
+class QuantMT:
+    """INT8 멀티태스크 (CPU). static은 quantize_mt.py가 저장한 TorchScript를 로드"""
+    def __init__(self, mode: str, net: nn.Module, src_path: str):
+        self.name = f"int8-{mode}"
+        torch.backends.quantized.engine = QUANT_ENGINE
+        if mode == "static":
+            self.path = quant_artifact_path(src_path)
+            if not os.path.exists(self.path):
+                raise RuntimeError(f"{self.path} 없음: python quantize_mt.py <calib_dir> 로 먼저 보정/저장")
+            self.net = torch.jit.load(self.path, map_location="cpu").eval()
+        else:
+            self.path = None
+            self.net = quantize_dynamic_heads(net)
+
+    def __call__(self, x: torch.Tensor):
+        type_logits, def_logit = self.net(x.cpu())
+        return type_logits.to(x.device), def_logit.to(x.device)
+
+def apply_quant_mode(backend, net: nn.Module, src_path: str):
+    if QUANT_MODE not in ("dynamic", "static"):
+        return backend
+    if DEVICE.type != "cpu":
+        print(f"[WARN] QUANT_MODE={QUANT_MODE} is CPU-only, ignored on {DEVICE}")
+        return backend
+    return QuantMT(QUANT_MODE, net, src_path)
 
 # ===================== YOLO Defect Model =====================
-yolo_model = YOLO(YOLO_MODEL_PATH)
+YOLO_EXPORT_SUFFIX = {"torchscript": ".torchscript", "onnx": ".onnx"}
 
-def yolo_defect_infer_pil(img: Image.Image, conf_th: float = YOLO_CONF_DEFECT) -> Dict:
-    results = yolo_model.predict(img, conf=conf_th, verbose=False)
-    r = results[0]
+def yolo_engine_path(name: str, src_path: str) -> str:
+    if name not in YOLO_EXPORT_SUFFIX:
+        return src_path
+    return _artifact_path(src_path, YOLO_EXPORT_SUFFIX[name])
+
+def load_yolo(name: str, src_path: str):
+    """백엔드에 맞는 YOLO 로드. export 결과물은 .pt 옆에 캐시"""
+    path = yolo_engine_path(name, src_path)
+    if path == src_path:
+        return YOLO(src_path)
+    if not _is_fresh(path, src_path):
+        path = YOLO(src_path).export(format=name, imgsz=YOLO_IMGSZ, dynamic=(name == "onnx"))
+        print(f"[INFO] YOLO exported: {path}")
+    return YOLO(path, task="detect")
+
+yolo_model = None  # load_models()
+# TorchScript YOLO는 배치 1로 trace되므로 배치 추론 시 한 장씩 실행
+YOLO_STATIC_BATCH = INFER_BACKEND == "torchscript"
 
+def _parse_yolo_result(r, conf_th: float = 0.0) -> Dict:
     has_defect = False
     num_defects = 0
     max_conf = 0.0
@@ -84,18 +421,152 @@ def yolo_defect_infer_pil(img: Image.Image, conf_th: float = YOLO_CONF_DEFECT) -
         cls_list = r.boxes.cls.tolist()
         conf_list = r.boxes.conf.tolist()
         for cls_id, c in zip(cls_list, conf_list):
-            if int(cls_id) == 1:  # 1 = Scratch_Defect
+            if int(cls_id) == 1 and c >= conf_th:  # 1 = Scratch_Defect
                 num_defects += 1
                 if c > max_conf:
                     max_conf = float(c)
 
     has_defect = num_defects > 0
     return {
+        "evaluated": True,
         "has_defect": has_defect,
         "num_defects": num_defects,
         "max_conf": max_conf if has_defect else 0.0,
     }
 
+def yolo_defect_infer_pil(img: Image.Image, conf_th: float = YOLO_CONF_DEFECT) -> Dict:
+    t = time.perf_counter()
+    results = yolo_model.predict(img, conf=conf_th, imgsz=YOLO_IMGSZ, verbose=False)
+    observe("yolo_forward", (time.perf_counter() - t) * 1000)
+    return _parse_yolo_result(results[0])
+
+def yolo_defect_infer_batch(imgs: List[Image.Image], conf_th: float = YOLO_CONF_DEFECT) -> List[Dict]:
+    if YOLO_STATIC_BATCH:
+        return [yolo_defect_infer_pil(img, conf_th) for img in imgs]
+    t = time.perf_counter()
+    results = yolo_model.predict(imgs, conf=conf_th, imgsz=YOLO_IMGSZ, verbose=False)
+    observe("yolo_forward", (time.perf_counter() - t) * 1000)
+    return [_parse_yolo_result(r) for r in results]
+
+def _class_boxes(r, classes, conf_th: float) -> List[tuple]:
+    """classes 박스 [(x1, y1, x2, y2, conf)] (base 이미지 좌표, conf 내림차순)"""
+    if r.boxes is None or len(r.boxes) == 0:
+        return []
+    boxes = [
+        (*xyxy, float(c))
+        for xyxy, cls_id, c in zip(r.boxes.xyxy.tolist(), r.boxes.cls.tolist(), r.boxes.conf.tolist())
+        if int(cls_id) in classes and c >= conf_th
+    ]
+    return sorted(boxes, key=lambda b: -b[4])
+
+def yolo_detect_batch(imgs: List[Image.Image]) -> List[tuple]:
+    """ROI 모드: YOLO 한 번으로 [(불량 결과, 부품 박스 목록, 불량 박스 목록)].
+    낮은 conf로 돌리고 불량은 YOLO_CONF_DEFECT로 다시 거름"""
+    conf = min(ROI_CONF, YOLO_CONF_DEFECT)
+    t = time.perf_counter()
+    if YOLO_STATIC_BATCH:
+        results = [yolo_model.predict(img, conf=conf, imgsz=YOLO_IMGSZ, verbose=False)[0] for img in imgs]
+    else:
+        results = yolo_model.predict(imgs, conf=conf, imgsz=YOLO_IMGSZ, verbose=False)
+    observe("yolo_forward", (time.perf_counter() - t) * 1000)
+    return [
+        (_parse_yolo_result(r, YOLO_CONF_DEFECT), _class_boxes(r, ROI_CLASSES, ROI_CONF), _class_boxes(r, {1}, YOLO_CONF_DEFECT))
+        for r in results
+    ]
+
+# ===================== Feature Store =====================
+class FeatureStore:
+    """
+    append-only 특징 파일: <dir>/<backbone>.f16 (float16, 행 = 이미지) + <dir>/<backbone>.keys (행별 sha256).
+    특징을 먼저 쓰고 키를 나중에 쓰므로, 도중에 죽어도 열 때 짧은 쪽 기준으로 잘라 행이 어긋나지 않음.
+    <backbone>.json의 weights(백본 가중치 digest)가 다르면 기존 파일을 <backbone>.<digest>-<시각>.*로 옮기고 새로 시작
+    """
+    def __init__(self, root: str, backbone: str, dim: int, weights: str):
+        os.makedirs(root, exist_ok=True)
+        self.backbone = backbone
+        self.dim = dim
+        self.weights = weights
+        self.feat_path, self.keys_path, meta_path = FeatureStore.paths(root, backbone)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                old = json.load(f)
+            if old.get("weights") != weights or old.get("dim") != dim:
+                FeatureStore.rotate(root, backbone, f"{old.get('weights') or 'legacy'}-{int(time.time())}")
+        if not os.path.exists(meta_path):
+            with open(meta_path, "w") as f:
+                json.dump({"backbone": backbone, "dim": dim, "dtype": "float16", "weights": weights}, f)
+
+        self.keys = FeatureStore.read_keys(self.keys_path)
+        rows = os.path.getsize(self.feat_path) // (2 * dim) if os.path.exists(self.feat_path) else 0
+        n = min(rows, len(self.keys))
+        if rows != n:
+            with open(self.feat_path, "r+b") as f:
+                f.truncate(n * 2 * dim)
+        if len(self.keys) != n:
+            self.keys = self.keys[:n]
+            with open(self.keys_path, "w") as f:
+                f.writelines(k + "\n" for k in self.keys)
+        self.known = set(self.keys)
+        self.lock = threading.Lock()
+        self.appended = 0
+
+    @staticmethod
+    def paths(root: str, backbone: str):
+        base = os.path.join(root, backbone)
+        return base + ".f16", base + ".keys", base + ".json"
+
+    @staticmethod
+    def weights_digest(state_dict) -> str:
+        """state_dict의 backbone.* 텐서 sha256 앞 16자 (헤드만 바뀐 ckpt는 같은 값 → 저장된 특징 그대로 유효)"""
+        h = hashlib.sha256()
+        for k in sorted(k for k in state_dict if k.startswith("backbone.")):
+            h.update(k.encode())
+            h.update(state_dict[k].detach().cpu().reshape(-1).contiguous().view(torch.uint8).numpy())
+        return h.hexdigest()[:16]
+
+    @staticmethod
+    def rotate(root: str, backbone: str, tag: str):
+        """다른 가중치로 만든 특징 → <backbone>.<tag>.*로 옮겨 둠 (지우지 않음)"""
+        for src, dst in zip(FeatureStore.paths(root, backbone), FeatureStore.paths(root, f"{backbone}.{tag}")):
+            if os.path.exists(src):
+                os.replace(src, dst)
+        print(f"[INFO] feature store {backbone}: backbone weights changed, old rows moved to {backbone}.{tag}.*")
+
+    @staticmethod
+    def read_keys(path: str) -> List[str]:
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [line.strip() for line in f]
+
+    def append(self, keys: List[Optional[str]], feats: torch.Tensor):
+        """추론 워커에서 호출. 이미 저장된 이미지와 같은 배치 안 중복(같은 sha256)은 건너뜀.
+        중복 검사도 lock 안에서 해야 추론 워커 여러 개가 같은 이미지를 동시에 넣지 않음"""
+        feats = feats.to(torch.float16).cpu()
+        with self.lock:
+            rows, seen = [], set()
+            for i, k in enumerate(keys):
+                if k and k not in self.known and k not in seen:
+                    seen.add(k)
+                    rows.append(i)
+            if not rows:
+                return
+            data = feats[rows].numpy().tobytes()
+            with open(self.feat_path, "ab") as f:
+                f.write(data)
+            with open(self.keys_path, "a") as f:
+                f.writelines(keys[i] + "\n" for i in rows)
+            for i in rows:
+                self.keys.append(keys[i])
+                self.known.add(keys[i])
+            self.appended += len(rows)
+
+    def stats(self) -> Dict:
+        return {"backbone": self.backbone, "dim": self.dim, "weights": self.weights, "rows": len(self.keys),
+                "appended": self.appended, "path": self.feat_path}
+
+feature_store: Optional[FeatureStore] = None  # load_models() (FEATURE_STORE_DIR)
+
 # ===================== Preprocess & TTA =====================
 class SquarePad:
     def __call__(self, img: Image.Image):
@@ -108,47 +579,150 @@ class SquarePad:
         else:
             return transforms.functional.pad(img, [0, pad // 2, 0, pad - pad // 2], fill=0)
 
-def build_tf_center(img_size: int):
-    return transforms.Compose([
-        transforms.Resize(int(img_size * 1.15)),
-        transforms.CenterCrop(img_size),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406],
-                             [0.229, 0.224, 0.225]),
-    ])
-
-def build_tf_square(img_size: int):
-    return transforms.Compose([
-        SquarePad(),
-        transforms.Resize(img_size),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406],
-                             [0.229, 0.224, 0.225]),
-    ])
-
-TF_LIST = [build_tf_center(IMG_SIZE), build_tf_square(IMG_SIZE)]
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
 
-@torch.inference_mode()
-def infer_pil(img: Image.Image) -> Dict:
-    img = img.convert("RGB")
-    type_logits_sum = None
-    def_logit_sum = 0.0
+def _geo_center(img_size: int) -> list:
+    return [transforms.Resize(int(img_size * 1.15)), transforms.CenterCrop(img_size)]
 
-    for tf in TF_LIST:
-        x = tf(img).unsqueeze(0).to(DEVICE, non_blocking=True)
-        for flip in (False, True):
-            xi = torch.flip(x, dims=[3]) if flip else x
-            with torch.cuda.amp.autocast(enabled=(DEVICE.type == "cuda")):
-                type_logits, def_logit = model(xi)
-            type_logits_sum = type_logits if type_logits_sum is None else (type_logits_sum + type_logits)
-            def_logit_sum += def_logit
+def _geo_square(img_size: int) -> list:
+    return [SquarePad(), transforms.Resize(img_size)]
 
-    n = len(TF_LIST) * 2
-    type_logits = type_logits_sum / n
-    def_logit = def_logit_sum / n
+def build_tf_center(img_size: int, to_tensor: bool = True):
+    tail = [transforms.ToTensor(), transforms.Normalize(MEAN, STD)] if to_tensor else []
+    return transforms.Compose(_geo_center(img_size) + tail)
+
+def build_tf_square(img_size: int, to_tensor: bool = True):
+    tail = [transforms.ToTensor(), transforms.Normalize(MEAN, STD)] if to_tensor else []
+    return transforms.Compose(_geo_square(img_size) + tail)
+
+TF_LIST: list = []   # load_models()에서 IMG_SIZE 기준으로 채움
+GEO_LIST: list = []  # TF_LIST와 같은 순서의 기하 변환만 (PIL → PIL, CPU_OPT 경로)
 
-    p_def = torch.sigmoid(def_logit)[0].item()
-    p_type = F.softmax(type_logits, dim=1)[0]
+# (x/255 - mean)/std = x * scale - shift → uint8 입력에서 곱/뺄셈 두 번으로 정규화
+_NORM_SCALE = (1.0 / (255.0 * torch.tensor(STD))).view(1, 3, 1, 1)
+_NORM_SHIFT = (torch.tensor(MEAN) / torch.tensor(STD)).view(1, 3, 1, 1)
+
+def mt_input(x: torch.Tensor) -> torch.Tensor:
+    """멀티태스크 입력 메모리 레이아웃 (CPU_OPT면 channels_last → oneDNN NHWC 커널)"""
+    return x.contiguous(memory_format=torch.channels_last) if CPU_OPT else x
+
+def _alloc_views(n: int, s: int):
+    u8 = torch.empty(n, 3, s, s, dtype=torch.uint8).contiguous(memory_format=torch.channels_last)
+    f32 = torch.empty(n, 3, s, s).contiguous(memory_format=torch.channels_last)
+    return u8, f32
+
+class InputBufferPool:
+    """TTA 입력용 (uint8, float32) 버퍼 쌍을 최대 배치 크기로 미리 잡아 두고 재사용"""
+
+    def __init__(self, n_buffers: int, capacity: int, img_size: int):
+        self.capacity = capacity
+        self.n_buffers = n_buffers
+        self.img_size = img_size
+        self._free = queue.SimpleQueue()
+        for _ in range(n_buffers):
+            self._free.put(_alloc_views(capacity, img_size))
+        self.hits = 0
+        self.misses = 0
+
+    @contextlib.contextmanager
+    def acquire(self, n: int):
+        bufs = None
+        if n <= self.capacity:
+            try:
+                bufs = self._free.get_nowait()
+            except queue.Empty:
+                pass
+        if bufs is None:
+            # 용량 초과/버퍼 모두 사용 중 → 이번만 새로 할당
+            self.misses += 1
+            yield _alloc_views(n, self.img_size)
+            return
+        self.hits += 1
+        try:
+            yield bufs
+        finally:
+            self._free.put(bufs)
+
+    def stats(self) -> Dict:
+        mb = self.n_buffers * self.capacity * 3 * self.img_size ** 2 * 5 / 2 ** 20
+        return {"buffers": self.n_buffers, "capacity_views": self.capacity, "memory_mb": round(mb, 1),
+                "hits": self.hits, "misses": self.misses}
+
+input_pool: Optional[InputBufferPool] = None  # load_models() (CPU_OPT)
+
+def _put_view(u8: torch.Tensor, j: int, geo, img: Image.Image):
+    # pil_to_tensor는 HWC 메모리를 CHW로 permute만 한 view → channels_last 버퍼로 그대로 복사
+    u8[j].copy_(transforms.functional.pil_to_tensor(geo(img)))
+
+def _normalize_into(u8: torch.Tensor, f32: torch.Tensor) -> torch.Tensor:
+    """uint8 뷰 → float 정규화를 미리 잡아 둔 버퍼에 직접 기록"""
+    torch.mul(u8, _NORM_SCALE, out=f32)
+    f32.sub_(_NORM_SHIFT)
+    return f32 if DEVICE.type == "cpu" else f32.to(DEVICE)
+
+def _fill_tta_views(imgs: List[Image.Image], u8: torch.Tensor, f32: torch.Tensor) -> torch.Tensor:
+    """build_tta_batch와 같은 순서(이미지별 [tf..., flip(tf)...])로 버퍼를 채움 → (N*V, 3, H, W)"""
+    g = len(GEO_LIST)
+    j = 0
+    for img in imgs:
+        for k, geo in enumerate(GEO_LIST):
+            _put_view(u8, j + k, geo, img)
+        u8[j + g:j + 2 * g].copy_(u8[j:j + g].flip(3))
+        j += 2 * g
+    return _normalize_into(u8[:j], f32[:j])
+
+def _base_scale(w: int, h: int, img_size: Optional[int] = None) -> float:
+    """center 뷰(짧은 변 IMG_SIZE*1.15), square 뷰/YOLO(긴 변 IMG_SIZE, YOLO_IMGSZ)를 모두 만족하는 최소 축소 비율.
+    ROI 모드는 멀티태스크가 작은 크롭을 보므로 긴 변 ROI_BASE_LONG까지 유지"""
+    if ROI_CROP:
+        return min(1.0, max(ROI_BASE_LONG, YOLO_IMGSZ) / max(w, h))
+    s = img_size or IMG_SIZE
+    need_short = int(s * 1.15)
+    need_long = max(s, YOLO_IMGSZ)
+    return min(1.0, max(need_short / min(w, h), need_long / max(w, h)))
+
+class BadImage(ValueError):
+    """디코딩할 수 없는 업로드 (이미지가 아니거나 잘린 파일)"""
+
+def decode_image(b: bytes) -> Image.Image:
+    """업로드 바이트를 한 번만 디코딩해 TTA 뷰와 YOLO 입력이 공유하는 축소 base 이미지(RGB)를 만듦.
+    base 크기는 디코딩 시점 슬롯의 IMG_SIZE 기준 → info["img_size"]로 남겨 교체 후에는 다시 디코딩"""
+    t = time.perf_counter()
+    s = IMG_SIZE  # 디코딩 도중 교체돼도 두 번의 _base_scale이 같은 크기를 쓰도록 한 번만 읽음
+    try:
+        img = Image.open(io.BytesIO(b))
+        w, h = img.size
+        frame_size = (w, h)
+        scale = _base_scale(w, h, s)
+        if PREPROC_DRAFT and img.format == "JPEG" and scale < 1.0:
+            # draft는 요청 크기 이상을 유지하는 가장 작은 DCT 스케일을 고름
+            img.draft("RGB", (math.ceil(w * scale), math.ceil(h * scale)))
+        img = img.convert("RGB")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise BadImage(str(e)) from e
+
+    w, h = img.size
+    scale = _base_scale(w, h, s)
+    if scale < 1.0:
+        img = img.resize((math.ceil(w * scale), math.ceil(h * scale)), Image.BILINEAR)
+    img.info["frame_size"] = frame_size  # ROI 박스를 원본 프레임 좌표로 돌려줄 때 사용
+    img.info["img_size"] = s
+    img.info["src"] = b                  # 교체 후 재디코딩용 (업로드 바이트 참조만 유지)
+    if feature_store is not None:
+        img.info["sha256"] = hashlib.sha256(b).hexdigest()  # 특징 저장소 키
+    observe("decode", (time.perf_counter() - t) * 1000)
+    return img
+
+def build_tta_batch(img: Image.Image) -> torch.Tensor:
+    """전처리 2종 × 좌우반전 뷰를 (V, 3, H, W) 텐서 하나로 쌓음"""
+    x = torch.stack([tf(img) for tf in TF_LIST], 0)
+    return torch.cat([x, torch.flip(x, dims=[3])], 0)
+
+def decide(type_logits: torch.Tensor, def_logit: torch.Tensor) -> Dict:
+    """TTA 평균 logit(배치 1) → 최종 라벨 + 확률"""
+    p_def = torch.sigmoid(def_logit.float())[0].item()
+    p_type = F.softmax(type_logits.float(), dim=1)[0]
 
     if p_def >= THRESH_HIGH:
         final = "defect"
@@ -165,6 +739,871 @@ def infer_pil(img: Image.Image) -> Dict:
     }
     return {"final": final, "probs": probs}
 
+@torch.inference_mode()
+def infer_pil(img: Image.Image, batched: Optional[bool] = None, backend=None) -> Dict:
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if batched is None:
+        batched = TTA_BATCHED
+    if backend is None:
+        backend = mt_backend
+
+    if batched:
+        return infer_pil_batch([img], backend)[0]
+
+    type_logits_sum = None
+    def_logit_sum = 0.0
+    n = len(TF_LIST) * 2
+
+    if CPU_OPT:
+        # 뷰별 forward는 유지하되 입력은 버퍼 한 번 채워서 슬라이스로
+        with input_pool.acquire(n) as (u8, f32):
+            x = _fill_tta_views([img], u8, f32)
+            for k in range(n):
+                type_logits, def_logit = backend(x[k:k + 1])
+                type_logits_sum = type_logits if type_logits_sum is None else (type_logits_sum + type_logits)
+                def_logit_sum += def_logit
+        return {**decide(type_logits_sum / n, def_logit_sum / n), "tta_views": n}
+
+    for tf in TF_LIST:
+        x = tf(img).unsqueeze(0).to(DEVICE, non_blocking=True)
+        for flip in (False, True):
+            xi = torch.flip(x, dims=[3]) if flip else x
+            type_logits, def_logit = backend(xi)
+            type_logits_sum = type_logits if type_logits_sum is None else (type_logits_sum + type_logits)
+            def_logit_sum += def_logit
+
+    return {**decide(type_logits_sum / n, def_logit_sum / n), "tta_views": n}
+
+def _stage(stage: str, fn, *args):
+    t = time.perf_counter()
+    out = fn(*args)
+    observe(stage, (time.perf_counter() - t) * 1000)
+    return out
+
+def _stack_views(imgs: List[Image.Image]) -> torch.Tensor:
+    return torch.cat([build_tta_batch(img) for img in imgs], 0)
+
+def _early_exit_ok(type_logits: torch.Tensor, def_logit: torch.Tensor) -> bool:
+    """center 뷰 logit(1장)만으로 판정이 확실한지"""
+    p_def = torch.sigmoid(def_logit.float()).item()
+    if THRESH_LOW - TTA_EARLY_MARGIN <= p_def < THRESH_HIGH + TTA_EARLY_MARGIN:
+        return False
+    if p_def < THRESH_LOW:
+        # 101/701 판정은 불량이 아닐 때만 의미 있음
+        p_type = F.softmax(type_logits.float(), dim=-1)
+        if abs(p_type[0] - p_type[1]).item() < TTA_TYPE_MARGIN:
+            return False
+    return True
+
+def _tensor_views(imgs: List[Image.Image]):
+    """적응형 TTA 입력 (기본): 뷰마다 ToTensor/Normalize → (center(), others(hard))"""
+    x0 = None
+
+    def center():
+        nonlocal x0
+        x0 = torch.stack([TF_LIST[0](img) for img in imgs], 0)
+        return x0.to(DEVICE, non_blocking=True)
+
+    def others(hard):
+        def other_views(i):
+            x_other = torch.stack([tf(imgs[i]) for tf in TF_LIST[1:]], 0)
+            return torch.cat([x_other, torch.flip(x0[i:i + 1], dims=[3]), torch.flip(x_other, dims=[3])], 0)
+        return torch.cat([other_views(i) for i in hard], 0).to(DEVICE, non_blocking=True)
+
+    return center, others
+
+def _pooled_views(imgs: List[Image.Image], u8: torch.Tensor, f32: torch.Tensor):
+    """적응형 TTA 입력 (CPU_OPT): center 뷰는 버퍼 앞 N칸, 나머지 뷰는 그 뒤에 이어서 기록"""
+    n = len(imgs)
+
+    def center():
+        for i, img in enumerate(imgs):
+            _put_view(u8, i, GEO_LIST[0], img)
+        return _normalize_into(u8[:n], f32[:n])
+
+    def others(hard):
+        j = n
+        for i in hard:
+            g = len(GEO_LIST)
+            for k, geo in enumerate(GEO_LIST[1:]):
+                _put_view(u8, j + k, geo, imgs[i])
+            u8[j + g - 1].copy_(u8[i].flip(2))
+            u8[j + g:j + 2 * g - 1].copy_(u8[j:j + g - 1].flip(3))
+            j += 2 * g - 1
+        return _normalize_into(u8[n:j], f32[n:j])
+
+    return center, others
+
+def _infer_adaptive(imgs: List[Image.Image], backend) -> List[Dict]:
+    if CPU_OPT:
+        with input_pool.acquire(len(imgs) * len(TF_LIST) * 2) as (u8, f32):
+            return _adaptive_core(imgs, backend, *_pooled_views(imgs, u8, f32))
+    return _adaptive_core(imgs, backend, *_tensor_views(imgs))
+
+def _adaptive_core(imgs: List[Image.Image], backend, center, others) -> List[Dict]:
+    """1단계: center 뷰만 forward. 2단계: 애매한 이미지만 나머지 뷰를 모아 한 번 더 forward"""
+    n = len(imgs)
+    x0 = _stage("preprocess", center)
+    t0, d0 = _stage("mt_forward", backend, x0)
+
+    outs: List[Optional[Dict]] = [None] * n
+    hard = []
+    for i in range(n):
+        if _early_exit_ok(t0[i], d0[i]):
+            outs[i] = {**decide(t0[i:i + 1], d0[i:i + 1]), "tta_views": 1}
+        else:
+            hard.append(i)
+
+    if hard:
+        rest = _stage("preprocess", others, hard)
+        t1, d1 = _stage("mt_forward", backend, rest)
+        k = len(TF_LIST) * 2 - 1
+        t1 = t1.view(len(hard), k, -1)
+        d1 = d1.view(len(hard), k)
+        for j, i in enumerate(hard):
+            type_logits = (t0[i] + t1[j].sum(0)) / (k + 1)
+            def_logit = (d0[i] + d1[j].sum(0)) / (k + 1)
+            outs[i] = {**decide(type_logits[None], def_logit[None]), "tta_views": k + 1}
+    return outs
+
+@torch.inference_mode()
+def infer_pil_batch(imgs: List[Image.Image], backend=None) -> List[Dict]:
+    """N장 × TTA 뷰 V개를 (N*V, 3, H, W) 한 번의 forward로 처리"""
+    if backend is None:
+        backend = mt_backend
+    if not TTA_BATCHED:
+        return [infer_pil(img, batched=False, backend=backend) for img in imgs]
+
+    imgs = [img if img.mode == "RGB" else img.convert("RGB") for img in imgs]
+    if TTA_ADAPTIVE:
+        return _infer_adaptive(imgs, backend)
+
+    # 특징 저장: 헤드가 Linear라 head(TTA 평균 특징) = TTA 평균 logit → 저장한 특징만으로 같은 판정 재현
+    capture = feature_store is not None and isinstance(backend, EagerMT)
+    forward = backend.with_features if capture else backend
+    if CPU_OPT:
+        with input_pool.acquire(len(imgs) * len(TF_LIST) * 2) as (u8, f32):
+            x = _stage("preprocess", _fill_tta_views, imgs, u8, f32)
+            out = _stage("mt_forward", forward, x)
+    else:
+        x = _stage("preprocess", _stack_views, imgs).to(DEVICE, non_blocking=True)
+        out = _stage("mt_forward", forward, x)
+    type_logits, def_logit = out[0], out[1]
+    n = len(imgs)
+    views = type_logits.shape[0] // n
+    if capture:
+        feature_store.append([img.info.get("sha256") for img in imgs], out[2].float().view(n, views, -1).mean(1))
+    type_logits = type_logits.view(n, views, type_logits.shape[-1]).mean(1)
+    def_logit = def_logit.view(n, views).mean(1)
+    return [{**decide(type_logits[i:i + 1], def_logit[i:i + 1]), "tta_views": views} for i in range(n)]
+
+def _timed(fn, *args):
+    t = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - t) * 1000
+
+def _run_pair(mt_fn, yolo_fn, x):
+    """yolo_executor가 있으면 YOLO는 전용 워커에서, 멀티태스크는 현재 스레드에서 동시에 실행"""
+    if yolo_executor is not None:
+        yolo_fut = yolo_executor.submit(_timed, yolo_fn, x)
+        mt_out, latency_mt = _timed(mt_fn, x)
+        yolo_out, latency_yolo = yolo_fut.result()
+    else:
+        mt_out, latency_mt = _timed(mt_fn, x)
+        yolo_out, latency_yolo = _timed(yolo_fn, x)
+    return mt_out, yolo_out, latency_mt, latency_yolo
+
+# ===================== Cascade =====================
+# 캐스케이드로 YOLO를 건너뛴 경우의 결과 (값이 아니라 "평가 안 함"임을 명시)
+YOLO_NOT_EVALUATED = {"evaluated": False, "has_defect": None, "num_defects": None, "max_conf": None}
+
+def cascade_reason(mt_out: Dict) -> str:
+    """YOLO 실행 여부 판단 → uncertain | audit | skip"""
+    if CASCADE_P_LOW <= mt_out["probs"]["defect"] <= CASCADE_P_HIGH:
+        return "uncertain"
+    if random.random() < CASCADE_AUDIT_RATES.get(mt_out["final"], 0.0):
+        return "audit"
+    return "skip"
+
+def _run_cascade(imgs: List[Image.Image]):
+    """멀티태스크 배치 → 캐스케이드 조건을 만족한 이미지만 YOLO 배치 (PARALLEL_MODELS보다 우선)"""
+    mt_outs, latency_mt = _timed(infer_pil_batch, imgs)
+    reasons = [cascade_reason(m) for m in mt_outs]
+    yolo_outs = [dict(YOLO_NOT_EVALUATED) for _ in imgs]
+    latency_yolo = 0.0
+
+    idx = [i for i, r in enumerate(reasons) if r != "skip"]
+    if idx:
+        ys, latency_yolo = _timed(yolo_defect_infer_batch, [imgs[i] for i in idx])
+        for i, y in zip(idx, ys):
+            yolo_outs[i] = y
+    for y, r in zip(yolo_outs, reasons):
+        y["cascade"] = r
+    return mt_outs, yolo_outs, latency_mt, latency_yolo
+
+# ===================== ROI Crop =====================
+def roi_box(box: tuple, w: int, h: int) -> tuple:
+    """부품 박스 → 긴 변 기준 정사각 + ROI_PAD 여백 크롭 박스 (이미지 밖으로 나가면 안쪽으로 밀어 넣음)"""
+    x1, y1, x2, y2 = box[:4]
+    side = max(x2 - x1, y2 - y1) * (1 + 2 * ROI_PAD)
+    sw, sh = min(side, w), min(side, h)
+    left = min(max(0.0, (x1 + x2 - sw) / 2), w - sw)
+    top = min(max(0.0, (y1 + y2 - sh) / 2), h - sh)
+    return int(left), int(top), int(math.ceil(left + sw)), int(math.ceil(top + sh))
+
+def _frame_box(box: tuple, img: Image.Image) -> List[int]:
+    """base 이미지 좌표 → 업로드 원본 프레임 좌표"""
+    fw, fh = img.info.get("frame_size", img.size)
+    sx, sy = fw / img.width, fh / img.height
+    return [round(box[0] * sx), round(box[1] * sy), round(box[2] * sx), round(box[3] * sy)]
+
+def _defects_in(box: tuple, defects: List[tuple]) -> int:
+    """중심이 부품 박스 안에 있는 불량 박스 수"""
+    x1, y1, x2, y2 = box[:4]
+    return sum(1 for d in defects if x1 <= (d[0] + d[2]) / 2 <= x2 and y1 <= (d[1] + d[3]) / 2 <= y2)
+
+def _run_roi(imgs: List[Image.Image]):
+    """YOLO(불량 + 부품 위치) → 부품 크롭 배치로 멀티태스크. 부품을 못 찾은 이미지는 전체 프레임으로 분류.
+    ROI_MULTI면 모든 이미지의 부품 크롭을 한 번의 forward로 돌리고, 대표 결과는 p_def가 가장 높은 부품"""
+    dets, latency_yolo = _timed(yolo_detect_batch, imgs)
+    crops, owners = [], []   # owners[k] = (이미지 번호, roi 또는 None)
+    for i, (img, (_, boxes, defects)) in enumerate(zip(imgs, dets)):
+        if not boxes:
+            crops.append(img)
+            owners.append((i, None))
+            continue
+        for box in boxes[:ROI_MAX_PARTS if ROI_MULTI else 1]:
+            crop = roi_box(box, *img.size)
+            crops.append(img.crop(crop))
+            owners.append((i, {"box": _frame_box(box, img), "crop": _frame_box(crop, img),
+                               "conf": round(box[4], 4), "yolo_num_defects": _defects_in(box, defects)}))
+    outs, latency_mt = _timed(infer_pil_batch, crops)
+
+    parts: List[List[Dict]] = [[] for _ in imgs]
+    for (i, roi), m in zip(owners, outs):
+        parts[i].append({"index": len(parts[i]), **m, "roi": roi})
+    mt_outs = []
+    for ps in parts:
+        top = max(ps, key=lambda p: p["probs"]["defect"])
+        mt_outs.append({**top, "parts": ps} if ROI_MULTI else top)
+    return mt_outs, [y for y, _, _ in dets], latency_mt, latency_yolo
+
+def _result(mt_out: Dict, yolo_out: Dict, latency_pre: float, latency_mt: float, latency_yolo: float) -> Dict:
+    return {
+        "mt": mt_out,
+        "yolo": yolo_out,
+        "latency_preproc_ms": latency_pre,
+        "latency_mt_ms": latency_mt,
+        "latency_yolo_ms": latency_yolo,
+    }
+
+def _for_active_slot(decoded: List[tuple]) -> List[tuple]:
+    """slot_gate.work() 안에서 호출: 교체 전 슬롯 IMG_SIZE로 디코딩된 이미지는 현재 슬롯 기준으로 다시 디코딩"""
+    return [d if d[0].info.get("img_size") == IMG_SIZE else _timed(decode_image, d[0].info["src"]) for d in decoded]
+
+def run_models_decoded(decoded: List[tuple]) -> List[Dict]:
+    """디코딩 끝난 [(base 이미지, latency_preproc_ms), ...] → 멀티태스크 + YOLO 배치"""
+    t = time.perf_counter()
+    with slot_gate.work():
+        decoded = _for_active_slot(decoded)
+        imgs = [img for img, _ in decoded]
+        if ROI_CROP:
+            mt_outs, yolo_outs, latency_mt, latency_yolo = _run_roi(imgs)
+        elif CASCADE_ENABLED:
+            mt_outs, yolo_outs, latency_mt, latency_yolo = _run_cascade(imgs)
+        else:
+            mt_outs, yolo_outs, latency_mt, latency_yolo = _run_pair(infer_pil_batch, yolo_defect_infer_batch, imgs)
+    admission.record_service((time.perf_counter() - t) * 1000, len(imgs))
+    return [
+        _result(m, y, latency_pre, latency_mt, latency_yolo)
+        for (_, latency_pre), m, y in zip(decoded, mt_outs, yolo_outs)
+    ]
+
+# ===================== Model Loading & Warmup =====================
+MODELS_READY = threading.Event()
+STARTUP_TIMINGS: Dict[str, float] = {}
+LOAD_ERROR: Optional[str] = None
+_load_lock = threading.Lock()
+
+def _file_stamp(path: str) -> Optional[tuple]:
+    """(mtime_ns, size), 없으면 None (허브 이름 등)"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+class ModelSlot:
+    """교체 단위: 멀티태스크 + YOLO와 ckpt에 딸린 설정/입력 버퍼. load_slot으로 만들고 activate_slot으로 전역에 반영"""
+    def __init__(self, ckpt_path: str, yolo_path: str, meta: Dict[str, str],
+                 thresh_high: Optional[float], thresh_low: Optional[float]):
+        self.ckpt_path = ckpt_path
+        self.yolo_path = yolo_path
+        self.ckpt_stamp = _file_stamp(ckpt_path)  # 같은 경로에 덮어쓴 파일 구분용
+        self.yolo_stamp = _file_stamp(yolo_path)
+        self.backbone = meta["backbone"]
+        self.img_size = int(meta["img"])
+        self.base_t_def = float(meta["threshold_defect"])
+        self.thresh_high = self.base_t_def if thresh_high is None else float(thresh_high)
+        self.thresh_low = max(0.0, self.base_t_def - 0.02) if thresh_low is None else float(thresh_low)
+        self.tf_list = [build_tf_center(self.img_size), build_tf_square(self.img_size)]
+        self.geo_list = [build_tf_center(self.img_size, to_tensor=False), build_tf_square(self.img_size, to_tensor=False)]
+        self.model = None
+        self.mt_backend = None
+        self.yolo_model = None
+        self.input_pool: Optional[InputBufferPool] = None
+        self.feature_store: Optional[FeatureStore] = None
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def version(self) -> str:
+        return (f"{os.path.basename(self.ckpt_path)}+{os.path.basename(self.yolo_path)}"
+                f"@{self.thresh_high:g}/{self.thresh_low:g}")
+
+def _env_float(name: str) -> Optional[float]:
+    v = os.getenv(name)
+    return float(v) if v else None
+
+def load_slot(ckpt_path: str, yolo_path: str, thresh_high: Optional[float] = None,
+              thresh_low: Optional[float] = None, reuse: Optional[ModelSlot] = None) -> ModelSlot:
+    """전역을 건드리지 않고 새 슬롯을 만듦. reuse와 ckpt/YOLO 파일이 같으면(경로 + mtime/크기) 모델은 그대로 공유 (임계값만 교체)"""
+    t0 = time.perf_counter()
+    ckpt_stamp = _file_stamp(ckpt_path)  # 로드 전에 찍음 → 로드 도중 덮어써지면 다음 교체에서 다시 로드
+    if reuse is not None and reuse.ckpt_path == ckpt_path and reuse.ckpt_stamp == ckpt_stamp:
+        meta = {"backbone": reuse.backbone, "img": str(reuse.img_size), "threshold_defect": str(reuse.base_t_def)}
+        slot = ModelSlot(ckpt_path, yolo_path, meta, thresh_high, thresh_low)
+        slot.model, slot.mt_backend = reuse.model, reuse.mt_backend
+        slot.input_pool, slot.feature_store = reuse.input_pool, reuse.feature_store
+    else:
+        meta, state_dict = load_mt_weights(ckpt_path)
+        slot = ModelSlot(ckpt_path, yolo_path, meta, thresh_high, thresh_low)
+        slot.ckpt_stamp = ckpt_stamp
+        net = build_mt_model(slot.backbone, state_dict)
+        if CPU_OPT:
+            net = net.to(memory_format=torch.channels_last)
+            top = max(warmup_batch_sizes()) if TTA_BATCHED else 1
+            if ROI_CROP and ROI_MULTI:
+                top *= ROI_MAX_PARTS  # 부품 크롭 수만큼 배치가 커짐
+            slot.input_pool = InputBufferPool(max(1, INFER_WORKERS), top * len(slot.tf_list) * 2, slot.img_size)
+        backend = build_mt_backend(INFER_BACKEND, net, ckpt_path, slot.img_size)
+        backend = apply_quant_mode(backend, net, ckpt_path)
+        if FEATURE_STORE_DIR:
+            if isinstance(backend, EagerMT) and TTA_BATCHED and not TTA_ADAPTIVE and not ROI_CROP:
+                slot.feature_store = FeatureStore(FEATURE_STORE_DIR, slot.backbone, net.backbone.num_features,
+                                                  FeatureStore.weights_digest(state_dict))
+            else:
+                print("[WARN] FEATURE_STORE_DIR needs INFER_BACKEND=torch, QUANT_MODE=none, full batched TTA "
+                      "and ROI_CROP=0; disabled")
+        slot.model, slot.mt_backend = net, backend
+    slot.timings["load_mt_s"] = round(time.perf_counter() - t0, 3)
+
+    t1 = time.perf_counter()
+    if reuse is not None and reuse.yolo_path == yolo_path and reuse.yolo_stamp == _file_stamp(yolo_path):
+        slot.yolo_model = reuse.yolo_model
+    else:
+        slot.yolo_model = load_yolo(INFER_BACKEND, yolo_path)
+    slot.timings["load_yolo_s"] = round(time.perf_counter() - t1, 3)
+    return slot
+
+active_slot: Optional[ModelSlot] = None
+
+def activate_slot(slot: ModelSlot):
+    """슬롯을 모듈 전역(서버 코드와 도구가 읽는 이름들)에 반영"""
+    global active_slot, CKPT_PATH, YOLO_MODEL_PATH, BACKBONE, IMG_SIZE, BASE_T_DEF, THRESH_HIGH, THRESH_LOW
+    global model, mt_backend, yolo_model, input_pool, feature_store, TF_LIST, GEO_LIST
+    CKPT_PATH, YOLO_MODEL_PATH = slot.ckpt_path, slot.yolo_path
+    BACKBONE, IMG_SIZE, BASE_T_DEF = slot.backbone, slot.img_size, slot.base_t_def
+    THRESH_HIGH, THRESH_LOW = slot.thresh_high, slot.thresh_low
+    TF_LIST, GEO_LIST = slot.tf_list, slot.geo_list
+    model, mt_backend, yolo_model = slot.model, slot.mt_backend, slot.yolo_model
+    input_pool, feature_store = slot.input_pool, slot.feature_store
+    active_slot = slot
+
+def load_models():
+    """멀티태스크 + YOLO 로드 (여러 번 호출해도 한 번만 로드). 도구 스크립트는 import 후 직접 호출"""
+    with _load_lock:
+        if active_slot is not None:
+            return
+        slot = load_slot(CKPT_PATH, YOLO_MODEL_PATH, _env_float("THRESH_HIGH"), _env_float("THRESH_LOW"))
+        STARTUP_TIMINGS.update(slot.timings)
+        activate_slot(slot)
+
+def _pow2_sizes(top: int) -> set:
+    """{1, 2, 4, ..., top 미만 2의 거듭제곱, top}"""
+    sizes = {1, top}
+    b = 2
+    while b < top:
+        sizes.add(b)
+        b *= 2
+    return sizes
+
+def warmup_batch_sizes() -> List[int]:
+    if WARMUP_BATCH_SIZES:
+        return sorted({int(s) for s in WARMUP_BATCH_SIZES.split(",") if s.strip()})
+    return sorted(_pow2_sizes(max(MICROBATCH_MAX_BATCH if MICROBATCH_ENABLED else 1, PREDICT_BATCH_MAX)))
+
+def warmup_shapes(views: int) -> tuple:
+    """요청 배치 크기 격자(warmup_batch_sizes)에서 파생되는 forward 배치 크기 → (멀티태스크, YOLO).
+    ROI_MULTI 크롭 수(n × 1..ROI_MAX_PARTS), 적응형 TTA 2단계(애매한 부분집합 k × (views-1)),
+    캐스케이드 YOLO 부분집합(k ≤ n)은 같은 격자 + 2의 거듭제곱으로 덮음"""
+    sizes = warmup_batch_sizes()
+    parts = ROI_MAX_PARTS if ROI_CROP and ROI_MULTI else 1
+    counts = {n * p for n in sizes for p in range(1, parts + 1)}   # 멀티태스크에 들어가는 이미지(크롭) 수
+    if not TTA_BATCHED:
+        mt = {1}
+    elif TTA_ADAPTIVE:
+        mt = counts | {k * (views - 1) for k in counts | _pow2_sizes(max(counts))}
+    else:
+        mt = {c * views for c in counts}
+    yolo = set(sizes)
+    if CASCADE_ENABLED and not ROI_CROP:
+        yolo |= _pow2_sizes(max(sizes))
+    return sorted(mt), sorted(yolo)
+
+@torch.inference_mode()
+def warmup_models(slot: Optional[ModelSlot] = None):
+    """운영에서 나오는 모든 forward 배치 크기(warmup_shapes)로 두 모델을 한 번씩 실행 (기본: 활성 슬롯)"""
+    slot = slot or active_slot
+    t0 = time.perf_counter()
+    views = len(slot.tf_list) * 2
+    s = slot.img_size
+    w, h = WARMUP_FRAME_SIZE
+    scale = _base_scale(w, h, s)
+    base = Image.new("RGB", (math.ceil(w * scale), math.ceil(h * scale)))
+
+    mt_sizes, yolo_sizes = warmup_shapes(views)
+    for m in mt_sizes:
+        slot.mt_backend(mt_input(torch.zeros(m, 3, s, s, device=DEVICE)))
+    if YOLO_STATIC_BATCH:
+        slot.yolo_model.predict(base, imgsz=YOLO_IMGSZ, verbose=False)
+    else:
+        for n in yolo_sizes:
+            slot.yolo_model.predict([base] * n, imgsz=YOLO_IMGSZ, verbose=False)
+    slot.timings["warmup_s"] = round(time.perf_counter() - t0, 3)
+    if slot is active_slot:
+        STARTUP_TIMINGS["warmup_s"] = slot.timings["warmup_s"]
+
+def _load_and_warmup():
+    global LOAD_ERROR
+    try:
+        load_models()
+        warmup_models()
+    except Exception as e:
+        LOAD_ERROR = repr(e)
+        print(f"[ERROR] model load/warmup failed: {e}")
+        return
+    STARTUP_TIMINGS["cold_start_s"] = round(time.time() - PROCESS_START, 3)
+    MODELS_READY.set()
+    SWAP_STATE["active_since"] = datetime.datetime.now().isoformat(timespec="seconds")
+    print(f"[INFO] models ready: cold start {STARTUP_TIMINGS['cold_start_s']}s "
+          f"(mt {STARTUP_TIMINGS['load_mt_s']}s, yolo {STARTUP_TIMINGS['load_yolo_s']}s, "
+          f"warmup {STARTUP_TIMINGS['warmup_s']}s, batch sizes {warmup_batch_sizes()})")
+
+# ===================== Hot Swap =====================
+class SlotGate:
+    """추론 작업(work)과 슬롯 교체(swap) 사이 게이트. 교체가 기다리는 동안 새 작업은 대기 → 교체가 굶지 않음.
+    작업 하나(run_models_decoded 1회)는 시작한 슬롯으로 끝까지 실행됨"""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._working = 0
+        self._swapping = False
+
+    @contextlib.contextmanager
+    def work(self):
+        with self._cond:
+            while self._swapping:
+                self._cond.wait()
+            self._working += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._working -= 1
+                if self._working == 0:
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def swap(self):
+        with self._cond:
+            self._swapping = True
+            while self._working:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._swapping = False
+                self._cond.notify_all()
+
+slot_gate = SlotGate()
+SWAP_STATE: Dict = {"state": "idle", "active_since": None, "last": None, "error": None}
+_swap_lock = threading.Lock()
+
+def swap_models(ckpt_path: str, yolo_path: str, thresh_high: Optional[float], thresh_low: Optional[float]):
+    """대기 슬롯에 로드 + 워밍업(서빙과 병행) → 진행 중 작업이 끝나는 즉시 전환 → 이전 슬롯 해제.
+    호출 전에 _swap_lock을 잡아 둬야 하며 끝나면 여기서 풂"""
+    global LOAD_ERROR
+    try:
+        old = active_slot
+        t0 = time.perf_counter()
+        SWAP_STATE.update(state="loading", error=None)
+        slot = load_slot(ckpt_path, yolo_path, thresh_high, thresh_low, reuse=old)
+        SWAP_STATE["state"] = "warming"
+        warmup_models(slot)
+
+        t1 = time.perf_counter()
+        with slot_gate.swap():
+            activate_slot(slot)
+        switch_ms = (time.perf_counter() - t1) * 1000
+
+        del old
+        gc.collect()
+        if DEVICE.type == "cuda":
+            torch.cuda.empty_cache()
+        LOAD_ERROR = None
+        SWAP_STATE.update(state="idle", active_since=datetime.datetime.now().isoformat(timespec="seconds"), last={
+            "version": slot.version,
+            "total_s": round(time.perf_counter() - t0, 3),
+            "switch_ms": round(switch_ms, 2),   # 진행 중 작업 대기 + 전역 교체
+            **slot.timings,
+        })
+        print(f"[INFO] model swapped to {slot.version} in {SWAP_STATE['last']['total_s']}s (switch {switch_ms:.1f}ms)")
+    except Exception as e:
+        SWAP_STATE.update(state="failed", error=repr(e))
+        print(f"[ERROR] model swap failed: {e}")
+    finally:
+        _swap_lock.release()
+
+swap_sync_task: Optional[asyncio.Task] = None
+swap_seq = 0  # 이 워커가 적용을 시작한 마지막 공유 교체 번호 (SWAP_SYNC_FILE)
+
+def read_swap_request() -> Optional[Dict]:
+    try:
+        with open(SWAP_SYNC_FILE) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def write_swap_request(req: Dict) -> int:
+    """교체 요청을 다음 seq로 기록 → seq. 워커 여러 개가 동시에 받아도 flock으로 seq가 겹치지 않고, tmp + replace라 반쯤 쓴 파일은 안 보임"""
+    with open(SWAP_SYNC_FILE + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        seq = (read_swap_request() or {}).get("seq", 0) + 1
+        tmp = f"{SWAP_SYNC_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({**req, "seq": seq}, f)
+        os.replace(tmp, SWAP_SYNC_FILE)
+    return seq
+
+async def _swap_sync_loop():
+    """공유 파일에 이 워커가 아직 적용하지 않은 요청이 있으면 교체 시작 (중간 요청은 건너뛰고 최신만).
+    fork로 다시 띄운 워커도 부모의 원래 모델에서 시작해 여기서 최신 교체를 따라잡음"""
+    global swap_seq
+    while True:
+        await asyncio.sleep(SWAP_SYNC_POLL_S)
+        if not MODELS_READY.is_set():
+            continue
+        req = await asyncio.to_thread(read_swap_request)
+        if not req or req.get("seq", 0) <= swap_seq:
+            continue
+        if not _swap_lock.acquire(blocking=False):
+            continue  # 진행 중인 교체가 끝나면 다음 폴링에서 적용
+        swap_seq = req["seq"]
+        asyncio.get_running_loop().run_in_executor(
+            None, swap_models, req["ckpt_path"], req["yolo_model_path"], req["thresh_high"], req["thresh_low"])
+
+def process_memory(pid="self") -> Dict[str, float]:
+    """/proc/<pid>/smaps_rollup 기준 메모리(MB). private = 이 프로세스만 쓰는 양 (워커 1개 추가 비용)"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            kb = {k: int(v.split()[0]) for k, v in (line.split(":", 1) for line in f if ":" in line and "kB" in line)}
+    except OSError:
+        return {}
+    mb = lambda *ks: round(sum(kb.get(k, 0) for k in ks) / 1024, 1)
+    return {
+        "rss": mb("Rss"),
+        "pss": mb("Pss"),
+        "shared": mb("Shared_Clean", "Shared_Dirty"),
+        "private": mb("Private_Clean", "Private_Dirty"),
+    }
+
+def _require_ready():
+    if not MODELS_READY.is_set():
+        raise HTTPException(status_code=503, detail=LOAD_ERROR or "models loading", headers={"Retry-After": "5"})
+
+# ===================== Inference Executor =====================
+infer_executor: Optional[ThreadPoolExecutor] = None
+yolo_executor: Optional[ThreadPoolExecutor] = None   # PARALLEL_MODELS 전용
+decode_executor: Optional[ThreadPoolExecutor] = None  # /predict_batch 병렬 디코딩
+
+def _init_torch_threads(n: int):
+    """executor 스레드 initializer: 이 스레드의 intra-op 스레드 수.
+    get_num_threads로 torch의 스레드별 지연 초기화를 먼저 끝내야 첫 연산 때 다른 스레드가 마지막으로 지정한 값으로 덮이지 않음"""
+    try:
+        torch.get_num_threads()
+        torch.set_num_threads(max(1, n))
+    except Exception:
+        pass
+
+async def run_in_infer(fn, *args):
+    """동기 추론 함수를 추론 전용 스레드 풀에서 실행하고 결과를 await"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(infer_executor, functools.partial(fn, *args))
+
+# ===================== Micro-batching =====================
+class MicroBatcher:
+    """동시 요청(디코딩 끝난 이미지)을 큐에 모아 최대 max_wait_ms / max_batch 단위로 run_batch 실행 후 각 future에 결과 전달"""
+    def __init__(self, run_batch, max_batch: int, max_wait_ms: float, concurrency: int = 1):
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.concurrency = max(1, concurrency)
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.batch_hist = collections.Counter()   # 배치 크기 → 횟수
+        self.depth_hist = collections.Counter()   # 배치 구성 직후 남은 큐 길이 → 횟수
+        self.max_depth = 0
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.queue is not None and not self.queue.empty():
+            _, fut = self.queue.get_nowait()
+            if not fut.done():
+                fut.set_exception(RuntimeError("server shutting down"))
+
+    async def submit(self, item):
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, fut))
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return await fut
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            # 워커가 모두 바쁘면 기다리는 동안 큐에 요청이 쌓여 다음 배치가 커짐
+            await self.slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self.slots.release()
+                raise
+            self.batch_hist[len(batch)] += 1
+            self.depth_hist[self.queue.qsize()] += 1
+            asyncio.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: list):
+        try:
+            outs = await run_in_infer(self.run_batch, [item for item, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            self.slots.release()
+        for (_, fut), out in zip(batch, outs):
+            if not fut.done():
+                fut.set_result(out)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue_depth": self.max_depth,
+            "batch_size_hist": dict(sorted(self.batch_hist.items())),
+            "queue_depth_hist": dict(sorted(self.depth_hist.items())),
+        }
+
+batcher: Optional[MicroBatcher] = None
+
+# ===================== Result Cache =====================
+def model_version() -> str:
+    """결과에 영향을 주는 모델/임계값 설정 (캐시 키에 포함)"""
+    return f"{CKPT_PATH}|{YOLO_MODEL_PATH}|{INFER_BACKEND}|{mt_backend.name}|{THRESH_HIGH}|{THRESH_LOW}|{YOLO_CONF_DEFECT}"
+
+class ResultCache:
+    """LRU + TTL 결과 캐시. 같은 키로 동시에 들어온 요청은 하나의 계산 결과를 공유(single-flight)"""
+    def __init__(self, max_size: int, ttl_s: float):
+        self.max_size = max_size
+        self.ttl = ttl_s
+        self.entries: "collections.OrderedDict[str, tuple]" = collections.OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    @staticmethod
+    def key(b: bytes) -> str:
+        return hashlib.sha256(b).hexdigest() + "|" + model_version()
+
+    async def get_or_compute(self, key: str, compute):
+        """→ (결과, "hit" | "shared" | "miss")"""
+        ent = self.entries.get(key)
+        if ent is not None:
+            if time.monotonic() - ent[0] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return ent[1], "hit"
+            del self.entries[key]
+
+        task = self.inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task), "shared"
+
+        self.misses += 1
+        task = asyncio.ensure_future(compute())
+        self.inflight[key] = task
+        task.add_done_callback(functools.partial(self._done, key))
+        return await asyncio.shield(task), "miss"
+
+    def _done(self, key: str, task: asyncio.Future):
+        self.inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.entries[key] = (time.monotonic(), task.result())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.shared
+        oldest = next(iter(self.entries.values()))[0] if self.entries else None
+        return {
+            "enabled": True,
+            "max_size": self.max_size,
+            "ttl_s": self.ttl,
+            "size": len(self.entries),
+            "inflight": len(self.inflight),
+            "oldest_age_s": round(time.monotonic() - oldest, 1) if oldest is not None else None,
+            "hits": self.hits,
+            "shared": self.shared,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared) / total, 4) if total else 0.0,
+        }
+
+result_cache: Optional[ResultCache] = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_S) if RESULT_CACHE_SIZE > 0 else None
+
+# ===================== Admission Control =====================
+INFLIGHT_IMAGES = Gauge("ai_inflight_images", "입장 후 처리 중인 이미지 수")
+ADMISSION_REJECTED = Counter("ai_admission_rejected_total", "입장 제어로 거절한 요청 수", ["reason"])
+
+class AdmissionController:
+    """처리 중 이미지 수 + 이미지당 처리 시간(EWMA)으로 새 요청의 대기 시간을 추정해 예산 초과 시 바로 거절"""
+    def __init__(self, budget_ms: float, max_inflight: int, workers: int, alpha: float = 0.2):
+        self.budget_ms = budget_ms
+        self.max_inflight = max(1, max_inflight)
+        self.workers = max(1, workers)
+        self.alpha = alpha
+        self.inflight = 0
+        self.service_ms: Optional[float] = None   # 이미지 1장당 추론 워커 점유 시간 (배치면 배치 시간 / 장수)
+        self.rejected = collections.Counter()
+
+    def record_service(self, ms: float, n: int):
+        """추론 워커에서 호출. 배치 처리 시간을 장당 시간으로 나눠 EWMA 갱신"""
+        if n <= 0:
+            return
+        per = ms / n
+        s = self.service_ms
+        self.service_ms = per if s is None else (1 - self.alpha) * s + self.alpha * per
+
+    def estimated_wait_ms(self, n: int = 0) -> Optional[float]:
+        if self.service_ms is None:
+            return None
+        return (self.inflight + n) * self.service_ms / self.workers
+
+    def _reject(self, status: int, reason: str, retry_after_s: float):
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.labels(reason).inc()
+        raise HTTPException(status_code=status, detail=f"overloaded ({reason})",
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after_s)))})
+
+    def _verdict(self, n: int):
+        """n장을 지금 받으면 안 되는 이유 → (status, reason, retry_after_s), 받아도 되면 None.
+        비어 있는 서버는 항상 받음 → 요청 크기만으로 영원히 거절되는 일은 없음 (배치는 묶음 단위로 호출)"""
+        if self.budget_ms <= 0 or self.inflight == 0:
+            return None
+        if self.inflight + n > self.max_inflight:
+            wait = self.estimated_wait_ms()
+            return 503, "max_inflight", (wait or 1000) / 1000
+        wait = self.estimated_wait_ms(n)
+        if wait is not None and wait > self.budget_ms:
+            # 예산 안으로 줄어들 때까지 걸리는 시간을 Retry-After로
+            return 429, "over_budget", (wait - self.budget_ms) / 1000
+        return None
+
+    def check(self, n: int):
+        """n장을 받아도 되는지 확인 (자리를 잡지는 않음, 이후 hold/acquire로 계수)"""
+        verdict = self._verdict(n)
+        if verdict is not None:
+            self._reject(*verdict)
+
+    async def wait(self, n: int):
+        """이미 받은 배치의 다음 묶음: 거절 대신 자리가 날 때까지 대기"""
+        while self._verdict(n) is not None:
+            await asyncio.sleep(0.05)
+
+    def acquire(self, n: int):
+        self.inflight += n
+        INFLIGHT_IMAGES.set(self.inflight)
+
+    def release(self, n: int):
+        self.inflight -= n
+        INFLIGHT_IMAGES.set(self.inflight)
+
+    @contextlib.contextmanager
+    def hold(self, n: int):
+        self.acquire(n)
+        try:
+            yield
+        finally:
+            self.release(n)
+
+    def stats(self) -> Dict:
+        wait = self.estimated_wait_ms()
+        return {
+            "enabled": self.budget_ms > 0,
+            "budget_ms": self.budget_ms,
+            "max_inflight": self.max_inflight,
+            "inflight_images": self.inflight,
+            "service_ms_per_image": round(self.service_ms, 2) if self.service_ms is not None else None,
+            "estimated_wait_ms": round(wait, 1) if wait is not None else None,
+            "rejected": dict(self.rejected),
+        }
+
+admission = AdmissionController(ADMISSION_BUDGET_MS, ADMISSION_MAX_INFLIGHT, INFER_WORKERS)
+
 # ===================== 외부 통신 클라이언트 =====================
 http_client: Optional[httpx.AsyncClient] = None
 mqtt_client: Optional[mqtt.Client] = None
@@ -179,24 +1618,254 @@ def _parse_mqtt_url(url: str):
         return host, int(port)
     return host_port, 1883
 
-async def notify_spring(payload: dict):
-    if not SPRING_NOTIFY_URL:
-        return
+# ===================== Trace =====================
+# hop 시각은 epoch ms (라즈베리파이/서버 간 비교는 NTP 동기화 전제). trace_waterfall.py로 부품별 구간 분석
+def now_ms() -> float:
+    return round(time.time() * 1000, 1)
+
+def parse_meta(meta: Optional[str]) -> dict:
+    """업로더가 폼 필드로 보낸 meta(JSON 문자열) → dict (없거나 깨졌으면 빈 dict)"""
+    if not meta:
+        return {}
     try:
-        assert http_client is not None
-        await http_client.post(SPRING_NOTIFY_URL, json=payload, timeout=SPRING_TIMEOUT)
-    except Exception:
-        # 로깅만 간단 처리 (필요 시 print→logger 교체)
-        print("[WARN] notify_spring failed")
+        parsed = json.loads(meta)
+    except json.JSONDecodeError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+def new_trace(meta: Optional[dict] = None, trace_id: Optional[str] = None,
+              recv_ms: Optional[float] = None) -> Dict:
+    """업로더 meta의 trace_id/hops를 이어받아 server_recv_ms부터 기록 (없으면 새 trace_id)"""
+    meta = meta or {}
+    hops = dict(meta.get("hops") or {})
+    hops["server_recv_ms"] = recv_ms or now_ms()
+    return {"trace_id": str(meta.get("trace_id") or trace_id or uuid.uuid4().hex), "hops": hops}
+
+# ===================== Outbound Notifier =====================
+NOTIFY_QUEUE_DEPTH = Gauge("ai_notify_queue_depth", "전송 대기 중인 결과 수", ["sink"])
+NOTIFY_SENT = Counter("ai_notify_sent_total", "전송 성공한 결과 수", ["sink"])
+NOTIFY_RETRIES = Counter("ai_notify_retries_total", "전송 재시도 횟수", ["sink"])
+NOTIFY_SPILLED = Counter("ai_notify_spilled_total", "디스크로 내린 결과 수", ["sink"])
+NOTIFY_DROPPED = Counter("ai_notify_dropped_total", "버린 결과 수", ["sink", "reason"])
+
+class NotifyRejected(Exception):
+    """수신 측이 4xx로 거부 → 재시도해도 소용없음"""
+
+class Notifier:
+    """결과 전송 큐: 묶어서 send_batch, 실패하면 지수 백오프 재시도, 큐 초과/재시도 소진 시 디스크 spill"""
+    def __init__(self, name: str, send_batch, batch_max: int):
+        self.name = name
+        self.send_batch = send_batch          # async (List[dict]) -> None, 실패 시 예외
+        self.batch_max = max(1, batch_max)
+        self.max_wait = max(0.0, NOTIFY_BATCH_WAIT_MS) / 1000
+        self.spill_path = os.path.join(NOTIFY_SPILL_DIR, f"{name}.jsonl") if NOTIFY_SPILL_DIR else ""
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.writer: Optional[ThreadPoolExecutor] = None  # spill 파일 전용 스레드 1개 (쓰기 순서 유지)
+        self.batch: List[dict] = []           # 큐에서 꺼냈지만 아직 전달/spill 안 된 묶음 (stop 시 spill)
+        self.healthy = True
+        self.counts = collections.Counter()   # sent / retries / spilled / dropped
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=max(1, NOTIFY_QUEUE_MAX))
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"spill-{self.name}")
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        rest, self.batch = self.batch, []
+        while self.queue is not None and not self.queue.empty():
+            rest.append(self.queue.get_nowait())
+        if rest:
+            await self._spill(rest, "shutdown")
+        if self.writer is not None:
+            self.writer.shutdown(wait=True)
+            self.writer = None
+
+    def submit(self, payload: dict):
+        """논블로킹 enqueue. 큐가 가득 차면 바로 spill (추론 경로를 막지 않음)"""
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self._spill([payload], "queue_full")
+        NOTIFY_QUEUE_DEPTH.labels(self.name).set(self.queue.qsize())
+
+    def _spill(self, items: List[dict], reason: str, count: bool = True) -> asyncio.Future:
+        """spill 쓰기를 전용 스레드로 넘김 → 장애 중 느리거나 가득 찬 디스크가 이벤트 루프(모든 요청)를 막지 않음"""
+        return asyncio.get_running_loop().run_in_executor(self.writer, self._write_spill, items, reason, count)
+
+    def _write_spill(self, items: List[dict], reason: str, count: bool):
+        if self.spill_path:
+            try:
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    for p in items:
+                        f.write(json.dumps(p, ensure_ascii=False) + "\n")
+                if count:
+                    self.counts["spilled"] += len(items)
+                    NOTIFY_SPILLED.labels(self.name).inc(len(items))
+                return
+            except OSError as e:
+                print(f"[WARN] notify {self.name} spill failed: {e}")
+                reason = "spill_failed"
+        self.counts["dropped"] += len(items)
+        NOTIFY_DROPPED.labels(self.name, reason).inc(len(items))
+
+    async def _collect(self):
+        """self.batch에 모음 (도중에 취소돼도 꺼낸 항목은 self.batch에 남음)"""
+        loop = asyncio.get_running_loop()
+        batch = self.batch
+        batch.append(await self.queue.get())
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.batch_max:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        NOTIFY_QUEUE_DEPTH.labels(self.name).set(self.queue.qsize())
+
+    async def _deliver(self, batch: List[dict]) -> bool:
+        """성공(또는 수신 측 거부로 버림) → True, 재시도 소진 → False"""
+        delay = NOTIFY_BACKOFF_BASE_S
+        for attempt in range(NOTIFY_MAX_RETRIES + 1):
+            t = time.perf_counter()
+            try:
+                await self.send_batch(batch)
+            except NotifyRejected as e:
+                print(f"[WARN] notify {self.name} rejected: {e}")
+                self.counts["dropped"] += len(batch)
+                NOTIFY_DROPPED.labels(self.name, "rejected").inc(len(batch))
+                return True
+            except Exception as e:
+                observe("dispatch", (time.perf_counter() - t) * 1000)
+                self.healthy = False
+                if attempt == NOTIFY_MAX_RETRIES:
+                    print(f"[WARN] notify {self.name} failed after {attempt + 1} tries: {e}")
+                    return False
+                self.counts["retries"] += 1
+                NOTIFY_RETRIES.labels(self.name).inc()
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))  # jitter
+                delay = min(delay * 2, NOTIFY_BACKOFF_MAX_S)
+                continue
+            observe("dispatch", (time.perf_counter() - t) * 1000)
+            self.healthy = True
+            self.counts["sent"] += len(batch)
+            NOTIFY_SENT.labels(self.name).inc(len(batch))
+            return True
+        return False
+
+    def _take_spill(self) -> List[dict]:
+        """spill 파일을 .replay로 옮겨서 읽음 (이전 재전송 도중 종료됐으면 남은 .replay부터).
+        .replay는 전달이 끝난 만큼만 _advance_replay로 줄여 나감 → 도중에 죽어도 남은 결과는 디스크에 있음"""
+        replay = self.spill_path + ".replay"
+        if not os.path.exists(replay):
+            if not os.path.exists(self.spill_path):
+                return []
+            os.replace(self.spill_path, replay)
+        with open(replay, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _advance_replay(self, rest: List[dict], to_spill: bool = False):
+        """전달된 앞부분을 .replay에서 제거 (남은 게 없으면 삭제). to_spill이면 남은 것을 spill 파일로 되돌림"""
+        replay = self.spill_path + ".replay"
+        if to_spill:
+            self._write_spill(rest, "retries_exhausted", False)
+            rest = []
+        if not rest:
+            if os.path.exists(replay):
+                os.remove(replay)
+            return
+        tmp = replay + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for p in rest:
+                f.write(json.dumps(p, ensure_ascii=False) + "\n")
+        os.replace(tmp, replay)
+
+    async def _replay_spill(self):
+        if not self.spill_path:
+            return
+        loop = asyncio.get_running_loop()
+        items = await loop.run_in_executor(self.writer, self._take_spill)
+        for i in range(0, len(items), self.batch_max):
+            if not await self._deliver(items[i:i + self.batch_max]):
+                await loop.run_in_executor(self.writer, self._advance_replay, items[i:], True)
+                return
+            await loop.run_in_executor(self.writer, self._advance_replay, items[i + self.batch_max:])
+
+    async def _run(self):
+        await self._replay_spill()
+        while True:
+            await self._collect()
+            if await self._deliver(self.batch):
+                self.batch = []
+                if self.spill_path and os.path.exists(self.spill_path):
+                    await self._replay_spill()
+            else:
+                batch, self.batch = self.batch, []
+                await self._spill(batch, "retries_exhausted")
 
-def publish_mqtt(payload: dict):
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "queue_max": NOTIFY_QUEUE_MAX,
+            "batch_max": self.batch_max,
+            "healthy": self.healthy,
+            "spill_path": self.spill_path or None,
+            **{k: self.counts[k] for k in ("sent", "retries", "spilled", "dropped")},
+        }
+
+def _stamp(payload: dict, hop: str) -> dict:
+    """싱크별 전송 시각을 hops에 더한 사본 (같은 payload를 여러 싱크가 공유하므로 원본은 그대로)"""
+    return {**payload, "hops": {**payload.get("hops", {}), hop: now_ms()}}
+
+async def _post_spring(batch: List[dict]):
+    if http_client is None:
+        raise RuntimeError("http client not ready")
+    batch = [_stamp(p, "spring_send_ms") for p in batch]
+    body = batch[0] if len(batch) == 1 else batch
+    r = await http_client.post(SPRING_NOTIFY_URL, json=body, timeout=SPRING_TIMEOUT)
+    if 400 <= r.status_code < 500 and r.status_code != 429:
+        raise NotifyRejected(f"HTTP {r.status_code}")
+    r.raise_for_status()
+
+_mqtt_inflight = 0  # QoS>0 publish 후 브로커 확인(on_publish) 전인 메시지 수
+
+def _on_mqtt_publish(client, userdata, mid, *args):
+    global _mqtt_inflight
+    _mqtt_inflight = max(0, _mqtt_inflight - 1)
+
+async def _publish_mqtt(batch: List[dict]):
+    global _mqtt_inflight
     if mqtt_client is None:
-        return
-    try:
-        msg = json.dumps(payload).encode("utf-8")
-        mqtt_client.publish(MQTT_TOPIC, msg, qos=MQTT_QOS)
-    except Exception:
-        print("[WARN] publish_mqtt failed")
+        raise RuntimeError("mqtt not connected")
+    for payload in batch:
+        msg = json.dumps(_stamp(payload, "mqtt_send_ms")).encode("utf-8")
+        info = mqtt_client.publish(MQTT_TOPIC, msg, qos=MQTT_QOS)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise RuntimeError(mqtt.error_string(info.rc))
+        if MQTT_QOS > 0:
+            _mqtt_inflight += 1
+
+notifiers: Dict[str, Notifier] = {}
+
+def dispatch_result(payload: dict):
+    """스프링/MQTT 전송 큐에 넣기만 함 (실제 전송/재시도는 Notifier 태스크)"""
+    for n in notifiers.values():
+        n.submit(payload)
 
 # ===================== FastAPI =====================
 app = FastAPI(
@@ -210,19 +1879,38 @@ app.add_middleware(
     allow_methods=["*"], allow_headers=["*"],
 )
 
+class RecvTimeMiddleware:
+    """요청 도착 시각(헤더 수신 직후, 폼 파싱 전)을 request.state에 기록 → receive 단계 / server_recv_ms 기준.
+    핸들러 안에서 재면 본문은 이미 스풀 파일로 받아진 뒤라 업로드 시간이 빠짐"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            state = scope.setdefault("state", {})
+            state["recv_t"] = time.perf_counter()
+            state["recv_ms"] = now_ms()
+        await self.app(scope, receive, send)
+
+app.add_middleware(RecvTimeMiddleware)
+
 @app.on_event("startup")
 async def _startup():
-    global http_client, mqtt_client
-    try:
-        torch.set_num_threads(1)
-    except Exception:
-        pass
-    try:
-        with torch.inference_mode():
-            x = torch.zeros(1, 3, IMG_SIZE, IMG_SIZE, device=DEVICE)
-            _ = model(x)
-    except Exception:
-        pass
+    global http_client, mqtt_client, batcher, infer_executor, yolo_executor, decode_executor, swap_sync_task
+    infer_executor = ThreadPoolExecutor(max_workers=max(1, INFER_WORKERS), thread_name_prefix="infer",
+                                        initializer=_init_torch_threads, initargs=(MT_THREADS,))
+    if PARALLEL_MODELS:
+        yolo_executor = ThreadPoolExecutor(max_workers=max(1, INFER_WORKERS), thread_name_prefix="yolo",
+                                           initializer=_init_torch_threads, initargs=(YOLO_THREADS,))
+
+    decode_executor = ThreadPoolExecutor(max_workers=max(1, DECODE_WORKERS), thread_name_prefix="decode")
+
+    # 모델 로드 + 워밍업은 추론 워커에서 백그라운드로 (그동안 /health, /ready는 바로 응답)
+    asyncio.get_running_loop().run_in_executor(infer_executor, _load_and_warmup)
+
+    if MICROBATCH_ENABLED:
+        batcher = MicroBatcher(run_models_decoded, MICROBATCH_MAX_BATCH, MICROBATCH_MAX_WAIT_MS, INFER_WORKERS)
+        batcher.start()
 
     # httpx 클라이언트
     http_client = httpx.AsyncClient(timeout=SPRING_TIMEOUT)
@@ -239,10 +1927,41 @@ async def _startup():
             print(f"[INFO] MQTT connected {host}:{port}, topic={MQTT_TOPIC}")
         except Exception as e:
             print(f"[WARN] MQTT connect failed: {e}")
+        mqtt_client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+        mqtt_client.on_publish = _on_mqtt_publish
+
+    # 결과 전송 큐 (MQTT는 아두이노가 메시지 1건 = 결과 1건으로 받으므로 묶지 않음)
+    if SPRING_NOTIFY_URL:
+        notifiers["spring"] = Notifier("spring", _post_spring, SPRING_BATCH_MAX)
+    if MQTT_BROKER_URL:
+        notifiers["mqtt"] = Notifier("mqtt", _publish_mqtt, 1)
+    for n in notifiers.values():
+        n.start()
+
+    if SWAP_SYNC_FILE:
+        swap_sync_task = asyncio.create_task(_swap_sync_loop())
 
 @app.on_event("shutdown")
 async def _shutdown():
-    global http_client, mqtt_client
+    global http_client, mqtt_client, batcher, infer_executor, yolo_executor, decode_executor, swap_sync_task
+    if batcher is not None:
+        await batcher.stop()
+        batcher = None
+    if infer_executor is not None:
+        infer_executor.shutdown(wait=True)
+        infer_executor = None
+    if yolo_executor is not None:
+        yolo_executor.shutdown(wait=True)
+        yolo_executor = None
+    if decode_executor is not None:
+        decode_executor.shutdown(wait=True)
+        decode_executor = None
+    if swap_sync_task is not None:
+        swap_sync_task.cancel()
+        swap_sync_task = None
+    for n in notifiers.values():
+        await n.stop()
+    notifiers.clear()
     if http_client is not None:
         await http_client.aclose()
         http_client = None
@@ -254,11 +1973,24 @@ async def _shutdown():
             pass
         mqtt_client = None
 
+@app.get("/ready")
+def ready():
+    body = {"ready": MODELS_READY.is_set(), "error": LOAD_ERROR, "startup": STARTUP_TIMINGS}
+    return JSONResponse(body, status_code=200 if MODELS_READY.is_set() else 503)
+
 @app.get("/health")
 def health():
     return {
-        "status": "ok",
+        "status": "ok" if MODELS_READY.is_set() else ("error" if LOAD_ERROR else "loading"),
+        "startup": STARTUP_TIMINGS,
+        "model": {"version": active_slot.version if active_slot is not None else None, **SWAP_STATE,
+                  "swap_sync": {"file": SWAP_SYNC_FILE, "seq": swap_seq} if SWAP_SYNC_FILE else None},
+        "worker": {"pid": os.getpid(), "memory_mb": process_memory()},
         "device": str(DEVICE),
+        "infer_workers": INFER_WORKERS,
+        "predict_batch": {"decode_workers": DECODE_WORKERS, "max_batch": PREDICT_BATCH_MAX},
+        "parallel_models": {"enabled": PARALLEL_MODELS, "mt_threads": MT_THREADS,
+                            "yolo_threads": YOLO_THREADS if PARALLEL_MODELS else MT_THREADS},
         "backbone": BACKBONE,
         "img_size": IMG_SIZE,
         "threshold_defect_base": BASE_T_DEF,
@@ -266,99 +1998,409 @@ def health():
         "threshold_low": THRESH_LOW,
         "ckpt_path": CKPT_PATH,
         "yolo_model_path": YOLO_MODEL_PATH,
+        "backend": {"name": INFER_BACKEND, "mt": getattr(mt_backend, "name", None), "mt_artifact": getattr(mt_backend, "path", None), "yolo_artifact": yolo_engine_path(INFER_BACKEND, YOLO_MODEL_PATH)},
         "yolo_conf_defect": YOLO_CONF_DEFECT,
-        "tta": {"transforms": ["center", "squarepad"], "flip": True},
+        "yolo_imgsz": YOLO_IMGSZ,
+        "cascade": {
+            "enabled": CASCADE_ENABLED,
+            "p_def_window": [CASCADE_P_LOW, CASCADE_P_HIGH],
+            "audit_rates": CASCADE_AUDIT_RATES,
+        },
+        "roi_crop": {"enabled": ROI_CROP, "classes": sorted(ROI_CLASSES), "conf": ROI_CONF,
+                     "pad": ROI_PAD, "base_long": ROI_BASE_LONG, "multi": ROI_MULTI, "max_parts": ROI_MAX_PARTS},
+        "preproc_draft": PREPROC_DRAFT,
+        "cpu_opt": {"enabled": CPU_OPT, "input_pool": input_pool.stats() if input_pool is not None else None},
+        "tta": {"transforms": ["center", "squarepad"], "flip": True, "batched": TTA_BATCHED,
+                "adaptive": TTA_ADAPTIVE, "early_margin": TTA_EARLY_MARGIN, "type_margin": TTA_TYPE_MARGIN},
         "spring_notify_url": SPRING_NOTIFY_URL,
         "mqtt": {
             "broker_url": MQTT_BROKER_URL,
             "topic": MQTT_TOPIC,
-            "qos": MQTT_QOS
-        }
+            "qos": MQTT_QOS,
+            "inflight": _mqtt_inflight,
+        },
+        "notify": {name: n.stats() for name, n in notifiers.items()},
+        "admission": admission.stats(),
+        "feature_store": feature_store.stats() if feature_store is not None else None,
+        "microbatch": batcher.stats() if batcher is not None else {"enabled": False},
+        "result_cache": result_cache.stats() if result_cache is not None else {"enabled": False},
     }
 
+class SwapIn(BaseModel):
+    ckpt_path: Optional[str] = None         # 생략 시 현재 ckpt
+    yolo_model_path: Optional[str] = None   # 생략 시 현재 YOLO
+    thresh_high: Optional[float] = None     # 생략 시 ckpt가 같으면 현재 값, 바뀌면 새 ckpt 기본값
+    thresh_low: Optional[float] = None
+
+@app.post("/admin/swap", status_code=202)
+async def admin_swap(req: SwapIn, x_admin_token: Optional[str] = Header(None)):
+    """새 ckpt/YOLO/임계값을 대기 슬롯에 백그라운드로 로드 + 워밍업 후 무중단 전환 (진행 상황은 /health model).
+    SWAP_SYNC_FILE이 있으면 요청만 기록 → 모든 워커가 SWAP_SYNC_POLL_S 안에 각자 교체 (워커별 진행은 /health)"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="admin endpoints disabled (set ADMIN_TOKEN)")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="invalid admin token")
+    _require_ready()
+    ckpt = req.ckpt_path or CKPT_PATH
+    yolo = req.yolo_model_path or YOLO_MODEL_PATH
+    if not os.path.exists(ckpt):
+        raise HTTPException(status_code=400, detail=f"ckpt not found: {ckpt}")
+    same_ckpt = ckpt == CKPT_PATH
+    high = req.thresh_high if req.thresh_high is not None else (THRESH_HIGH if same_ckpt else None)
+    low = req.thresh_low if req.thresh_low is not None else (THRESH_LOW if same_ckpt else None)
+
+    if SWAP_SYNC_FILE:
+        req = {"ckpt_path": ckpt, "yolo_model_path": yolo, "thresh_high": high, "thresh_low": low}
+        seq = await asyncio.to_thread(write_swap_request, req)
+        return {"accepted": True, "fanout": True, "seq": seq, "active": active_slot.version, **req}
+    if not _swap_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="swap already in progress")
+    asyncio.get_running_loop().run_in_executor(None, swap_models, ckpt, yolo, high, low)
+    return {"accepted": True, "active": active_slot.version, "ckpt_path": ckpt, "yolo_model_path": yolo}
+
+@app.get("/metrics")
+def metrics():
+    # 예) histogram_quantile(0.95, sum by (le, stage) (rate(ai_stage_latency_ms_bucket[5m])))
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+class PartOut(BaseModel):
+    index: int                      # 프레임 안 부품 번호 (검출 conf 내림차순)
+    final: str
+    probs: Dict[str, float]
+    tta_views: int
+    roi: Optional[Dict] = None      # 부품 미검출로 전체 프레임을 분류했으면 None
+
 class PredictOut(BaseModel):
     final: str
     probs: Dict[str, float]
     latency_ms: float
-    yolo_has_defect: bool
-    yolo_num_defects: int
-    yolo_max_conf: float
+    yolo_evaluated: bool            # False면 캐스케이드로 YOLO 생략 (아래 yolo_* 값은 None)
+    yolo_has_defect: Optional[bool]
+    yolo_num_defects: Optional[int]
+    yolo_max_conf: Optional[float]
+    cascade_reason: Optional[str]   # uncertain | audit | skip (캐스케이드 비활성 시 None)
     latency_yolo_ms: float
+    latency_mt_ms: float
+    latency_preproc_ms: float
+    tta_views: int                  # 실제 사용한 TTA 뷰 수 (적응형 TTA면 1 또는 전체)
+    trace_id: Optional[str] = None
+    cached: bool = False            # 결과 캐시 히트 (latency_mt/yolo/preproc_ms는 0)
+    roi: Optional[Dict] = None      # ROI 모드: {"box", "crop": 원본 프레임 [x1, y1, x2, y2], "conf", "yolo_num_defects"}
+    parts: Optional[List[PartOut]] = None  # ROI_MULTI: 부품별 결과 (위 final/probs/roi는 p_def 최대 부품)
 
-def _build_payload(mt_out: Dict, yolo_out: Dict, latency_all: float, latency_yolo: float, image_id: str) -> dict:
+def _build_payload(res: Dict, latency_all: float, image_id: str, trace: Dict) -> dict:
+    mt_out, yolo_out = res["mt"], res["yolo"]
     return {
         "image_id": image_id,
+        "trace_id": trace["trace_id"],
+        "hops": trace["hops"],
         "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
         "final": mt_out["final"],
         "probs": mt_out["probs"],
+        "tta_views": mt_out["tta_views"],
+        "roi": mt_out.get("roi"),
+        "parts": mt_out.get("parts"),
         "latency_ms": round(latency_all, 2),
+        "yolo_evaluated": yolo_out["evaluated"],
         "yolo_has_defect": yolo_out["has_defect"],
         "yolo_num_defects": yolo_out["num_defects"],
-        "yolo_max_conf": float(yolo_out["max_conf"]),
-        "latency_yolo_ms": round(latency_yolo, 2),
+        "yolo_max_conf": yolo_out["max_conf"],
+        "cascade_reason": yolo_out.get("cascade"),
+        "latency_yolo_ms": round(res["latency_yolo_ms"], 2),
+        "latency_mt_ms": round(res["latency_mt_ms"], 2),
+        "latency_preproc_ms": round(res["latency_preproc_ms"], 2),
+        "cached": res.get("cached", False),
     }
 
+def _predict_out(res: Dict, latency_all: float, trace_id: Optional[str] = None) -> PredictOut:
+    mt_out, yolo_out = res["mt"], res["yolo"]
+    return PredictOut(
+        trace_id=trace_id,
+        final=mt_out["final"],
+        probs=mt_out["probs"],
+        tta_views=mt_out["tta_views"],
+        roi=mt_out.get("roi"),
+        parts=mt_out.get("parts"),
+        latency_ms=round(latency_all, 2),
+        yolo_evaluated=yolo_out["evaluated"],
+        yolo_has_defect=yolo_out["has_defect"],
+        yolo_num_defects=yolo_out["num_defects"],
+        yolo_max_conf=yolo_out["max_conf"],
+        cascade_reason=yolo_out.get("cascade"),
+        latency_yolo_ms=round(res["latency_yolo_ms"], 2),
+        latency_mt_ms=round(res["latency_mt_ms"], 2),
+        latency_preproc_ms=round(res["latency_preproc_ms"], 2),
+        cached=res.get("cached", False),
+    )
+
+async def decode_upload(b: bytes) -> tuple:
+    """디코딩 스레드 풀에서 1장 디코딩 → (base 이미지, latency_preproc_ms). 깨진 업로드는 400"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(decode_executor, _timed, decode_image, b)
+    except BadImage as e:
+        raise HTTPException(status_code=400, detail=f"invalid image: {e}")
+
+async def _infer_one(b: bytes) -> Dict:
+    # 마이크로배치에 합류하기 전에 각자 디코딩 → 깨진 업로드가 같은 배치의 다른 요청까지 실패시키지 않음
+    with admission.hold(1):
+        decoded = await decode_upload(b)
+        if batcher is not None:
+            return await batcher.submit(decoded)
+        return (await run_in_infer(run_models_decoded, [decoded]))[0]
+
+def _finish(res: Dict, latency_all: float, image_id: str, trace: Dict):
+    """결과 → (외부 전송 payload, 응답 PredictOut)"""
+    t = time.perf_counter()
+    trace["hops"]["infer_done_ms"] = now_ms()
+    payload = _build_payload(res, latency_all, image_id, trace)
+    out = _predict_out(res, latency_all, trace["trace_id"])
+    PREDICTIONS.labels(out.final).inc()
+    observe("postprocess", (time.perf_counter() - t) * 1000)
+    return payload, out
+
 @app.post("/predict", response_model=PredictOut)
-async def predict(background: BackgroundTasks, file: UploadFile = File(...)):
+async def predict(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    meta: Optional[str] = Form(None),               # 업로더 메타 JSON (trace_id, hops, image_id, device ...)
+    x_cache_bypass: Optional[str] = Header(None),   # "1"이면 캐시 조회/저장 생략
+    x_trace_id: Optional[str] = Header(None),
+):
+    _require_ready()
+    meta_d = parse_meta(meta)
+    trace = new_trace(meta_d, x_trace_id, request.state.recv_ms)
+    response.headers["X-Trace-Id"] = trace["trace_id"]
+    admission.check(1)
     b = await file.read()
-    img = Image.open(io.BytesIO(b))
+    observe("receive", (time.perf_counter() - request.state.recv_t) * 1000)
 
     start_all = time.perf_counter()
-    mt_out = infer_pil(img)
-
-    start_yolo = time.perf_counter()
-    yolo_out = yolo_defect_infer_pil(img)
-    latency_yolo = (time.perf_counter() - start_yolo) * 1000
+    if result_cache is not None and x_cache_bypass != "1":
+        res, cache_status = await result_cache.get_or_compute(ResultCache.key(b), functools.partial(_infer_one, b))
+    else:
+        res, cache_status = await _infer_one(b), "bypass"
+    response.headers["X-Cache"] = cache_status
+    if cache_status == "hit":
+        # 저장된 단계별 지연은 처음 계산한 요청의 값 → 이번 요청은 모델을 돌리지 않았으므로 0 + cached 표시
+        res = {**res, "latency_preproc_ms": 0.0, "latency_mt_ms": 0.0, "latency_yolo_ms": 0.0, "cached": True}
     latency_all = (time.perf_counter() - start_all) * 1000
 
-    image_id = file.filename or "image"
-    payload = _build_payload(mt_out, yolo_out, latency_all, latency_yolo, image_id)
+    image_id = str(meta_d.get("image_id") or file.filename or "image")
+    payload, out = _finish(res, latency_all, image_id, trace)
 
-    # 응답은 바로 돌려주고, 외부 전송은 백그라운드로
-    if SPRING_NOTIFY_URL:
-        background.add_task(notify_spring, payload)
-    if MQTT_BROKER_URL:
-        background.add_task(publish_mqtt, payload)
+    # 응답은 바로 돌려주고, 외부 전송은 전송 큐로 (캐시 히트여도 매번 전송)
+    dispatch_result(payload)
 
-    return PredictOut(
-        final=mt_out["final"],
-        probs=mt_out["probs"],
-        latency_ms=round(latency_all, 2),
-        yolo_has_defect=yolo_out["has_defect"],
-        yolo_num_defects=yolo_out["num_defects"],
-        yolo_max_conf=float(yolo_out["max_conf"]),
-        latency_yolo_ms=round(latency_yolo, 2),
-    )
+    return out
+
+async def _decode_parallel(bs: List[bytes]) -> List[tuple]:
+    """디코딩 스레드 풀에서 병렬 디코딩 → 입력 순서대로 [(base 이미지, latency_preproc_ms), ...]"""
+    return await asyncio.gather(*(decode_upload(b) for b in bs))
+
+class UploadSpool:
+    """배치 업로드를 임시 파일 하나에 이어 붙여 둠 → _iter_batch가 묶음마다 필요한 만큼만 읽음 (업로드 전체를 RAM에 올리지 않음).
+    폼 파일은 핸들러가 반환되면 닫히므로 StreamingResponse 전에 옮겨 둬야 함"""
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.index: List[tuple] = []  # [(image_id, offset, length)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def extend(self, files: List[UploadFile]):
+        for f in files:
+            f.file.seek(0)
+            start = self.file.tell()
+            shutil.copyfileobj(f.file, self.file, 1 << 20)
+            self.index.append((f.filename or "image", start, self.file.tell() - start))
+        self.file.flush()
+
+    def read(self, i: int) -> bytes:
+        _, offset, length = self.index[i]
+        return os.pread(self.file.fileno(), length, offset)  # 파일 위치를 건드리지 않음
+
+    def close(self):
+        self.file.close()
+
+async def read_uploads(request: Request, files: List[UploadFile]) -> UploadSpool:
+    """업로드 → UploadSpool. receive는 요청 도착부터 전부 옮길 때까지 (요청당 1회)"""
+    spool = UploadSpool()
+    try:
+        await asyncio.to_thread(spool.extend, files)
+    except BaseException:
+        spool.close()
+        raise
+    observe("receive", (time.perf_counter() - request.state.recv_t) * 1000)
+    return spool
+
+async def _iter_batch(spool: UploadSpool, chunk_size: int):
+    """업로드를 chunk_size장씩 읽기/디코딩/추론하며 (image_id, res, latency_ms)를 입력 순서대로 yield.
+    현재 묶음을 추론하는 동안 다음 묶음 하나만 미리 읽고 디코딩하므로 메모리는 묶음 2개 분량으로 고정.
+    입장 계수도 묶음 단위 (디코딩 시작 ~ 추론 끝): 첫 묶음은 호출 전에 check, 다음 묶음은 자리가 날 때까지 대기"""
+    chunk_size = max(1, min(chunk_size, PREDICT_BATCH_MAX))
+    chunks = [range(i, min(i + chunk_size, len(spool))) for i in range(0, len(spool), chunk_size)]
+
+    async def read_and_decode(chunk):
+        await admission.wait(len(chunk))
+        admission.acquire(len(chunk))
+        try:
+            bs = await asyncio.to_thread(lambda: [spool.read(i) for i in chunk])
+            return await _decode_parallel(bs)
+        except BaseException:
+            admission.release(len(chunk))
+            raise
+
+    next_decode = asyncio.ensure_future(read_and_decode(chunks[0])) if chunks else None
+    next_n = len(chunks[0]) if chunks else 0
+    try:
+        for ci, chunk in enumerate(chunks):
+            decoded = await next_decode
+            next_decode = None
+            try:
+                if ci + 1 < len(chunks):
+                    next_decode = asyncio.ensure_future(read_and_decode(chunks[ci + 1]))
+                    next_n = len(chunks[ci + 1])
+                start_chunk = time.perf_counter()
+                outs = await run_in_infer(run_models_decoded, decoded)
+                latency_chunk = (time.perf_counter() - start_chunk) * 1000
+            finally:
+                admission.release(len(chunk))
+            del decoded
+
+            for i, res in zip(chunk, outs):
+                image_id = spool.index[i][0]
+                # 항목별 지연 = 자기 디코딩 시간 + 속한 배치의 모델 처리 시간
+                yield image_id, res, res["latency_preproc_ms"] + latency_chunk
+    finally:
+        if next_decode is not None:
+            # 미리 디코딩하던 묶음: 진행 중이면 취소(스스로 release), 이미 끝났으면 잡아 둔 자리를 여기서 반환
+            if next_decode.done() and not next_decode.cancelled() and next_decode.exception() is None:
+                admission.release(next_n)
+            next_decode.cancel()
 
 @app.post("/predict_batch", response_model=List[PredictOut])
-async def predict_batch(background: BackgroundTasks, files: List[UploadFile] = File(...)):
+async def predict_batch(request: Request, response: Response, files: List[UploadFile] = File(...)):
+    _require_ready()
+    admission.check(min(len(files), PREDICT_BATCH_MAX))  # 첫 묶음 기준 (이후 묶음은 _iter_batch에서 계수)
+    start_batch = time.perf_counter()
+    recv = request.state.recv_ms
     results: List[PredictOut] = []
-    for f in files:
-        b = await f.read()
-        img = Image.open(io.BytesIO(b))
 
-        start_all = time.perf_counter()
-        mt_out = infer_pil(img)
-
-        start_yolo = time.perf_counter()
-        yolo_out = yolo_defect_infer_pil(img)
-        latency_yolo = (time.perf_counter() - start_yolo) * 1000
-        latency_all = (time.perf_counter() - start_all) * 1000
-
-        image_id = f.filename or "image"
-        payload = _build_payload(mt_out, yolo_out, latency_all, latency_yolo, image_id)
-        if SPRING_NOTIFY_URL:
-            background.add_task(notify_spring, payload)
-        if MQTT_BROKER_URL:
-            background.add_task(publish_mqtt, payload)
-
-        results.append(PredictOut(
-            final=mt_out["final"],
-            probs=mt_out["probs"],
-            latency_ms=round(latency_all, 2),
-            yolo_has_defect=yolo_out["has_defect"],
-            yolo_num_defects=yolo_out["num_defects"],
-            yolo_max_conf=float(yolo_out["max_conf"]),
-            latency_yolo_ms=round(latency_yolo, 2),
-        ))
+    spool = await read_uploads(request, files)
+    try:
+        async for image_id, res, latency_all in _iter_batch(spool, PREDICT_BATCH_MAX):
+            payload, out = _finish(res, latency_all, image_id, new_trace(recv_ms=recv))
+            dispatch_result(payload)
+
+            results.append(out)
+    finally:
+        spool.close()
+
+    response.headers["X-Batch-Latency-Ms"] = f"{(time.perf_counter() - start_batch) * 1000:.2f}"
     return results
+
+@app.post("/predict_stream")
+async def predict_stream(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    chunk: int = Query(PREDICT_BATCH_MAX, ge=1),   # 작을수록 첫 결과가 빨리 나옴
+):
+    """/predict_batch와 같은 처리, 결과를 묶음 단위로 끝나는 대로 NDJSON 한 줄씩 전송.
+    클라이언트가 읽지 않으면 전송 버퍼가 차서 다음 묶음 추론도 멈춤(흐름 제어)"""
+    _require_ready()
+    admission.check(min(len(files), chunk, PREDICT_BATCH_MAX))  # 첫 묶음 기준 (이후 묶음은 _iter_batch에서 계수)
+    recv = request.state.recv_ms
+    spool = await read_uploads(request, files)
+
+    async def lines():
+        index = 0
+        try:
+            async for image_id, res, latency_all in _iter_batch(spool, chunk):
+                payload, out = _finish(res, latency_all, image_id, new_trace(recv_ms=recv))
+                dispatch_result(payload)
+                row = {"index": index, "image_id": image_id, **out.model_dump()}
+                index += 1
+                yield json.dumps(row, ensure_ascii=False) + "\n"
+        except HTTPException as ex:
+            # 응답이 이미 시작돼 상태 코드를 바꿀 수 없음 → 마지막 줄로 오류를 알리고 종료
+            yield json.dumps({"index": index, "error": ex.detail}, ensure_ascii=False) + "\n"
+        finally:
+            spool.close()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.websocket("/ws/predict")
+async def ws_predict(ws: WebSocket):
+    """
+    바이너리 프레임 = 이미지 1장, 텍스트 프레임 {"image_id": "...", "trace_id": "...", "hops": {...}} = 다음 이미지 메타 지정,
+    {"type": "end"} = 종료.
+    결과는 보낸 순서대로 JSON 텍스트 프레임으로 반환. 처리 중 이미지가 window개(?window=N, 기본 STREAM_WINDOW)에
+    도달하면 가장 오래된 결과를 보낼 때까지 소켓을 읽지 않으므로 클라이언트 전송이 자연스럽게 막힘.
+    """
+    await ws.accept()
+    if not MODELS_READY.is_set():
+        await ws.close(code=1013)  # Try Again Later
+        return
+    try:
+        window = max(1, int(ws.query_params.get("window", STREAM_WINDOW)))
+    except ValueError:
+        window = STREAM_WINDOW
+    pending: "collections.deque" = collections.deque()
+    seq = 0
+    next_meta: dict = {}
+
+    async def infer(b: bytes):
+        start = time.perf_counter()
+        res = await _infer_one(b)
+        return res, (time.perf_counter() - start) * 1000
+
+    async def send_oldest():
+        s, image_id, trace, task = pending.popleft()
+        try:
+            res, latency_all = await task
+        except Exception as ex:
+            await ws.send_json({"seq": s, "image_id": image_id, "error": str(ex)})
+            return
+        payload, out = _finish(res, latency_all, image_id, trace)
+        dispatch_result(payload)
+        await ws.send_json({"seq": s, "image_id": image_id, **out.model_dump()})
+
+    try:
+        while True:
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+            if msg.get("bytes") is not None:
+                image_id = str(next_meta.get("image_id") or f"ws-{seq}")
+                trace = new_trace(next_meta)
+                next_meta = {}
+                try:
+                    admission.check(1)
+                    task = asyncio.ensure_future(infer(msg["bytes"]))
+                except HTTPException as ex:
+                    # 거절도 보낸 순서대로 돌려주도록 실패한 future로 넣음
+                    task = asyncio.get_running_loop().create_future()
+                    task.set_exception(RuntimeError(f"{ex.detail}, retry after {ex.headers['Retry-After']}s"))
+                pending.append((seq, image_id, trace, task))
+                seq += 1
+                while len(pending) >= window:
+                    await send_oldest()
+            elif msg.get("text"):
+                try:
+                    ctrl = json.loads(msg["text"])
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(ctrl, dict):
+                    continue  # 1, "x", [] 같은 객체가 아닌 JSON은 무시
+                if ctrl.get("type") == "end":
+                    while pending:
+                        await send_oldest()
+                    await ws.close()
+                    break
+                next_meta = {**next_meta, **ctrl}
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for *_, task in pending:
+            task.cancel()
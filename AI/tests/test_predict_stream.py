@@ -0,0 +1,56 @@
+# test_predict_stream.py
+# /predict_stream 회귀 테스트: 업로드 여러 장을 실제 엔드포인트로 스트리밍 (폼 파일이 핸들러 반환 후 닫혀도 동작해야 함)
+#   모델은 로드하지 않고 디코딩/추론 함수만 가짜로 바꿈
+#   cd AI && python -m pytest -q tests
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("fastapi")
+pytest.importorskip("ultralytics")
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def server():
+    os.environ["CKPT_PATH"] = os.path.join(AI_DIR, "missing_ckpt.pt")  # 실제 로드는 실패하게 두고 MODELS_READY만 세움
+    os.environ["SPRING_NOTIFY_URL"] = ""
+    os.environ["MQTT_BROKER_URL"] = ""
+    os.environ["RESULT_CACHE_SIZE"] = "0"
+    sys.path.insert(0, AI_DIR)
+    sys.modules.pop("test", None)  # 표준 라이브러리 test 패키지 대신 AI/test.py
+    import test as module
+    return module
+
+
+def fake_result(b: bytes) -> dict:
+    return {
+        "mt": {"final": "101_top", "probs": {"defect": 0.01, "101_top": 0.9, "701_top": 0.1}, "tta_views": 4},
+        "yolo": {"evaluated": True, "has_defect": False, "num_defects": 0, "max_conf": 0.0},
+        "latency_preproc_ms": 1.0,
+        "latency_mt_ms": 2.0,
+        "latency_yolo_ms": 3.0,
+        "image": b.decode(),
+    }
+
+
+def test_predict_stream_multiple_files(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(server, "decode_image", lambda b: b)
+    monkeypatch.setattr(server, "run_models_decoded", lambda decoded: [fake_result(b) for b, _ in decoded])
+
+    with TestClient(server.app) as client:
+        server.MODELS_READY.set()
+        files = [("files", (f"img_{i}.jpg", f"frame-{i}".encode(), "image/jpeg")) for i in range(3)]
+        with client.stream("POST", "/predict_stream?chunk=1", files=files) as r:
+            assert r.status_code == 200
+            rows = [json.loads(line) for line in r.iter_lines() if line]
+
+    assert [row["index"] for row in rows] == [0, 1, 2]
+    assert [row["image_id"] for row in rows] == ["img_0.jpg", "img_1.jpg", "img_2.jpg"]
+    assert all("error" not in row and row["final"] == "101_top" for row in rows)
@@ -0,0 +1,121 @@
+# trace_waterfall.py
+# 부품(이미지) 1개가 트리거 → 촬영 → 업로드 → 추론 → Spring/MQTT 전송까지 거친 hop 시각으로 구간별 지연 분석
+#   - 입력: MQTT 결과 payload(JSONL, `mosquitto_sub -v` 출력도 가능) / Spring 수신 본문 / 업로더 TRACE_LOG
+#   - trace_id 기준으로 hops를 합쳐 구간 p50/p95/max 표 + 느린 부품부터 ASCII 워터폴 출력
+#   - 라즈베리파이와 서버 시계가 다르면(NTP 미동기) 업로드 ↔ 서버 수신 구간이 음수/과대로 보일 수 있음
+#
+#   mosquitto_sub -t factory/ai/result -v > results.log
+#   python trace_waterfall.py results.log --trace-log uploader_trace.jsonl --show 5
+import argparse
+import json
+
+
+# 파이프라인 순서 (payload의 hops 키 = 이름 + "_ms")
+HOP_ORDER = ["trigger_recv", "capture_start", "capture_end", "upload_start", "server_recv", "infer_done"]
+# 추론 이후 병렬로 일어나는 hop → 각각 infer_done(없으면 마지막 순차 hop)부터 잰 구간
+BRANCH_HOPS = ["response", "spring_send", "mqtt_send"]
+BAR_WIDTH = 60
+
+
+def percentile(sorted_vals, q: float) -> float:
+    k = (len(sorted_vals) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def parse_line(line: str):
+    """JSON 한 줄 → payload dict 목록. `topic {json}` 형식과 Spring 배치(list)도 허용"""
+    line = line.strip()
+    if not line:
+        return []
+    if not line.startswith(("{", "[")) and " " in line:
+        line = line.split(" ", 1)[1]
+    try:
+        obj = json.loads(line)
+    except json.JSONDecodeError:
+        return []
+    items = obj if isinstance(obj, list) else [obj]
+    return [o for o in items if isinstance(o, dict) and o.get("trace_id")]
+
+
+def load_traces(paths):
+    """→ {trace_id: {"image_id", "hops": {hop: ms}, "latency_ms"}}. 같은 trace_id의 hops는 합침"""
+    traces = {}
+    for path in paths:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                for obj in parse_line(line):
+                    t = traces.setdefault(obj["trace_id"], {"image_id": None, "hops": {}, "latency_ms": None})
+                    t["image_id"] = obj.get("image_id") or t["image_id"]
+                    t["latency_ms"] = obj.get("latency_ms", t["latency_ms"])
+                    for k, v in (obj.get("hops") or {}).items():
+                        if isinstance(v, (int, float)):
+                            t["hops"][k[:-3] if k.endswith("_ms") else k] = float(v)
+    return traces
+
+
+def segments(hops: dict):
+    """기록된 hop만 골라 구간 [(이름, 시작, 끝)]: 순차 hop은 인접끼리, 분기 hop은 마지막 순차 hop부터"""
+    seen = [(h, hops[h]) for h in HOP_ORDER if h in hops]
+    segs = [(f"{a}→{b}", ta, tb) for (a, ta), (b, tb) in zip(seen, seen[1:])]
+    if seen:
+        last, t_last = seen[-1]
+        segs += [(f"{last}→{h}", t_last, hops[h]) for h in BRANCH_HOPS if h in hops]
+    return segs
+
+
+def span(hops: dict):
+    """→ (첫 hop 시각, 마지막 hop 시각)"""
+    vals = [hops[h] for h in HOP_ORDER + BRANCH_HOPS if h in hops]
+    return min(vals), max(vals)
+
+
+def print_waterfall(trace_id: str, t: dict):
+    hops = t["hops"]
+    t0, t1 = span(hops)
+    width_ms = max(t1 - t0, 1e-6)
+    print(f"\n--- {t['image_id'] or '-'} (trace {trace_id}) total {t1 - t0:.1f} ms, server latency_ms={t['latency_ms']}")
+    for name, a, b in segments(hops):
+        start = int((a - t0) / width_ms * BAR_WIDTH)
+        width = max(1, int((b - a) / width_ms * BAR_WIDTH)) if b > a else 0
+        print(f"{name:<28}{b - a:>9.1f} ms |{' ' * start}{'#' * width}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="trace_id별 hop 시각 → 구간 지연 워터폴")
+    ap.add_argument("logs", nargs="+", help="MQTT/Spring 결과 payload 로그 (JSONL)")
+    ap.add_argument("--trace-log", action="append", default=[], help="업로더 TRACE_LOG (JSONL, 여러 번 지정 가능)")
+    ap.add_argument("--show", type=int, default=5, help="워터폴을 출력할 부품 수 (느린 순)")
+    args = ap.parse_args()
+
+    traces = load_traces(args.logs + args.trace_log)
+    traces = {k: t for k, t in traces.items() if len(t["hops"]) >= 2}
+    if not traces:
+        print("[WARN] hops가 2개 이상 기록된 trace 없음")
+        return 1
+
+    per_seg = {}
+    totals = {}
+    for trace_id, t in traces.items():
+        for name, a, b in segments(t["hops"]):
+            per_seg.setdefault(name, []).append(b - a)
+        t0, t1 = span(t["hops"])
+        totals[trace_id] = t1 - t0
+
+    # 표는 파이프라인 순서 (구간 끝 hop 기준)
+    order = {h: i for i, h in enumerate(HOP_ORDER + BRANCH_HOPS)}
+    print(f"traces: {len(traces)}")
+    print(f"\n{'segment (ms)':<28}{'n':>7}{'p50':>10}{'p95':>10}{'max':>10}")
+    rows = sorted(per_seg.items(), key=lambda kv: order[kv[0].split("→")[1]])
+    rows.append(("end-to-end", list(totals.values())))
+    for name, vals in rows:
+        v = sorted(vals)
+        print(f"{name:<28}{len(v):>7}{percentile(v, 0.5):>10.1f}{percentile(v, 0.95):>10.1f}{v[-1]:>10.1f}")
+
+    for trace_id in sorted(totals, key=totals.get, reverse=True)[:args.show]:
+        print_waterfall(trace_id, traces[trace_id])
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
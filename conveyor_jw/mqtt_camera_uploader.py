@@ -22,6 +22,7 @@ import json
 import signal
 import time
 import tempfile
+import uuid
 from datetime import datetime
 
 from dotenv import load_dotenv
@@ -48,6 +49,9 @@ CAM_WIDTH        = int(os.getenv("CAM_WIDTH", "1920"))
 CAM_HEIGHT       = int(os.getenv("CAM_HEIGHT", "1080"))
 JPEG_QUALITY     = int(os.getenv("JPEG_QUALITY", "90"))
 
+# 트레이스 로그(JSONL) 경로. 지정하면 촬영/업로드 hop 시각을 한 줄씩 기록 → AI/trace_waterfall.py --trace-log 로 합침
+TRACE_LOG        = os.getenv("TRACE_LOG", "")
+
 REQUEST_TIMEOUT  = 10   # HTTP 요청 타임아웃(초)
 DEBOUNCE_MS      = 300  # 같은 토픽에서 지나치게 자주 트리거가 올 때 무시하는 최소 간격(밀리초)
 # ---------------------------
@@ -114,22 +118,41 @@ def capture_to_bytes() -> bytes:
         except FileNotFoundError:
             pass
 
+def epoch_ms() -> float:
+    """hop 시각 기록용 epoch 밀리초 (AI 서버 now_ms와 같은 단위. 장비 간 비교는 NTP 동기화 전제)"""
+    return round(time.time() * 1000, 1)
+
+def write_trace(meta: dict):
+    """TRACE_LOG가 지정되어 있으면 trace_id/hops를 JSONL 한 줄로 추가"""
+    if not TRACE_LOG:
+        return
+    try:
+        with open(TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"trace_id": meta["trace_id"], "image_id": meta.get("image_id"),
+                                "hops": meta["hops"]}) + "\n")
+    except OSError as e:
+        print(f"[WARN] trace log: {e}")
+
 def upload_to_ai(image_bytes: bytes, meta: dict):
     """
     촬영한 이미지 바이트를 멀티파트 폼으로 AI 서버에 POST 업로드.
     - files: 실제 바이너리 파일 파트
-    - data: 부가 메타데이터(JSON 문자열)
+    - data: 부가 메타데이터(JSON 문자열, trace_id/hops 포함)
+    - headers: X-Trace-Id (서버 로그/응답 헤더와 맞춰보기 위함)
     - 예외 발생 시 raise_for_status로 HTTP 오류를 예외로 전파
     반환값: 서버의 응답 본문(텍스트)
     """
     files = {
-        "file": ("capture.jpg", image_bytes, "image/jpeg")
+        "file": (f"{meta['image_id']}.jpg", image_bytes, "image/jpeg")
     }
+    # 업로드 직전 시각을 hop으로 남긴 뒤 메타를 직렬화
+    meta["hops"]["upload_start_ms"] = epoch_ms()
     # 서버에서 메타데이터를 함께 기록/활용할 수 있도록 폼 필드로 전송
     data = {"meta": json.dumps(meta, ensure_ascii=False)}
+    headers = {"X-Trace-Id": meta["trace_id"]}
 
     # 타임아웃을 지정하여 네트워크 지연/끊김 시 스레드가 영원히 멈추지 않도록 방지
-    r = requests.post(AI_POST_URL, files=files, data=data, timeout=REQUEST_TIMEOUT)
+    r = requests.post(AI_POST_URL, files=files, data=data, headers=headers, timeout=REQUEST_TIMEOUT)
     r.raise_for_status()  # 4xx/5xx일 경우 예외 발생
     return r.text
 
@@ -172,10 +195,18 @@ def on_message(client, userdata, msg):
     except json.JSONDecodeError:
         trigger_info = {"raw": payload}
 
+    # 트레이스: 트리거가 trace_id를 주면 이어받고, 아니면 여기서 시작
+    if not isinstance(trigger_info, dict):
+        trigger_info = {"raw": trigger_info}
+    trace_id = str(trigger_info.pop("trace_id", "") or uuid.uuid4().hex)
+    hops = {"trigger_recv_ms": float(now_ms)}
+
     try:
         # ---- 1) 촬영 ----
         t0 = time.time()
+        hops["capture_start_ms"] = epoch_ms()
         img = capture_to_bytes()
+        hops["capture_end_ms"] = epoch_ms()
         t1 = time.time()
 
         # ---- 2) 업로드 ----
@@ -185,13 +216,19 @@ def on_message(client, userdata, msg):
             "ts": datetime.utcnow().isoformat() + "Z",  # 업로드 시각(UTC, ISO8601)
             "w": CAM_WIDTH,
             "h": CAM_HEIGHT,
-            **trigger_info                     # 트리거에 담긴 부가정보 병합
+            **trigger_info,                    # 트리거에 담긴 부가정보 병합
+            "trace_id": trace_id,
+            "image_id": f"capture_{trace_id}",
+            "hops": hops,
         }
         resp = upload_to_ai(img, meta)
+        hops["response_ms"] = epoch_ms()
         t2 = time.time()
+        write_trace(meta)
 
         # 처리 시간 로깅(성능 관찰/튜닝에 도움)
         print(f"[OK] Captured in {t1 - t0:.2f}s, uploaded in {t2 - t1:.2f}s, resp={resp[:120]}...")
+        print(f"[TRACE] {trace_id} " + " ".join(f"{k}={v:.0f}" for k, v in hops.items()))
 
     except Exception as e:
         # 예외는 로그만 찍고 루프 유지(서비스 지속성 확보)